@@ -1,5 +1,7 @@
 from flask import Flask, request, jsonify
-from model import db, Product, StockMovement
+from sqlalchemy.dialects.sqlite import insert
+from datetime import date, datetime, time, timedelta
+from model import db, Product, StockMovement, ProductBalance, DailyBalance, signed_quantity
 
 app = Flask(__name__)
 
@@ -21,6 +23,30 @@ def add_product():
     
     return jsonify({'id':product.id}), 201
 
+MOVEMENT_DELTA = db.case(
+    (StockMovement.movement_Type == 'stock_in', StockMovement.quantity),
+    else_ = -StockMovement.quantity
+)
+
+def movement_totals(product_id):
+    """(on-hand quantity, last movement id) straight from the movement log"""
+    return db.session.query(
+        db.func.coalesce(db.func.sum(MOVEMENT_DELTA), 0),
+        db.func.max(StockMovement.id)
+    ).filter(StockMovement.product_id == product_id).one()
+
+def rebuild_balance(product_id):
+    """Recompute a product's balance from its full movement log"""
+    total, last_id = movement_totals(product_id)
+    
+    balance = db.session.get(ProductBalance, product_id)
+    if not balance:
+        balance = ProductBalance(product_id = product_id)
+        db.session.add(balance)
+    balance.quantity = total
+    balance.last_movement_id = last_id
+    return balance
+
 @app.route('/products/<int:product_id>/stock', methods = ['POST'])
 def record_movement(product_id):
     data = request.get_json()
@@ -31,17 +57,110 @@ def record_movement(product_id):
         notes = data.get('notes')
     )
     db.session.add(movement)
+    db.session.flush()
+    
+    # Apply the delta in SQL so concurrent writers don't overwrite each other; the first movement
+    # for a product seeds the row from the log (which already includes it) instead of racing an insert
+    stmt = insert(ProductBalance).values(
+        product_id = product_id,
+        quantity = db.select(db.func.coalesce(db.func.sum(MOVEMENT_DELTA), 0))
+            .where(StockMovement.product_id == product_id).scalar_subquery(),
+        last_movement_id = movement.id
+    )
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements = ['product_id'],
+        set_ = {
+            'quantity': ProductBalance.quantity + signed_quantity(movement.quantity, movement.movement_Type),
+            'last_movement_id': stmt.excluded.last_movement_id
+        }
+    ))
+    
     db.session.commit()
     
     return jsonify({'id' : movement.id}), 201
 
+def snapshot_product(product_id, through_day):
+    """Compact movements after the latest snapshot into daily closing balances up to through_day"""
+    last = DailyBalance.query.filter_by(product_id = product_id).order_by(DailyBalance.day.desc()).first()
+    running = last.closing_quantity if last else 0
+    
+    day_col = db.func.date(StockMovement.created_at)
+    query = db.session.query(day_col, db.func.sum(MOVEMENT_DELTA)).filter(
+        StockMovement.product_id == product_id,
+        StockMovement.created_at < datetime.combine(through_day + timedelta(days = 1), time.min)
+    )
+    if last:
+        query = query.filter(StockMovement.created_at >= datetime.combine(last.day + timedelta(days = 1), time.min))
+    
+    created = 0
+    for day, change in query.group_by(day_col).order_by(day_col):
+        running += change
+        db.session.add(DailyBalance(product_id = product_id, day = date.fromisoformat(str(day)), closing_quantity = running))
+        created += 1
+    return created
+
+def quantity_as_of(product_id, cutoff):
+    """On-hand quantity from movements before cutoff: nearest snapshot plus the remaining delta"""
+    snapshot = DailyBalance.query.filter(
+        DailyBalance.product_id == product_id,
+        DailyBalance.day <= (cutoff - timedelta(days = 1)).date()
+    ).order_by(DailyBalance.day.desc()).first()
+    
+    query = db.session.query(db.func.coalesce(db.func.sum(MOVEMENT_DELTA), 0)).filter(
+        StockMovement.product_id == product_id,
+        StockMovement.created_at < cutoff
+    )
+    if snapshot:
+        query = query.filter(StockMovement.created_at >= datetime.combine(snapshot.day + timedelta(days = 1), time.min))
+    
+    base = snapshot.closing_quantity if snapshot else 0
+    return base + query.scalar(), snapshot
+
 @app.route('/inventory/products/<int:product_id>', methods= ['GET'])
 def view_inventory(product_id):
-    movement = StockMovement.query.filter_by(product_id = product_id).all()
-    current_quantity = sum(m.quantity if m.movement_Type == 'stock_in' else -m.quantity 
-                          for m in movement)  # Substracting the sales, removal and returning the currently in stock
+    if not db.session.get(Product, product_id):
+        return jsonify({'error' : 'Product not found'}), 404
+    
+    as_of = request.args.get('as_of')
+    if as_of:
+        try:
+            parsed = datetime.fromisoformat(as_of)
+        except ValueError:
+            return jsonify({'error' : 'as_of must be an ISO date or datetime'}), 400
+        # A bare date means "closing stock on that day"
+        cutoff = parsed + timedelta(days = 1) if len(as_of) == 10 else parsed + timedelta(microseconds = 1)
+        quantity, snapshot = quantity_as_of(product_id, cutoff)
+        
+        return jsonify({
+            'product id' : product_id,
+            'Quantity' : quantity,
+            'as_of' : as_of,
+            'snapshot_day' : snapshot.day.isoformat() if snapshot else None
+        })
     
-    return jsonify({'product id' : product_id, 'Quantity' : current_quantity})
+    balance = db.session.get(ProductBalance, product_id)
+    # No movements yet (or balances not rebuilt): answer from the log, reads don't write
+    quantity = balance.quantity if balance else movement_totals(product_id)[0]
+    
+    return jsonify({'product id' : product_id, 'Quantity' : quantity})
+
+@app.cli.command('rebuild-balances')
+def rebuild_balances():
+    """Rebuild every product balance from the StockMovement log"""
+    product_ids = [row.id for row in db.session.query(Product.id)]
+    for product_id in product_ids:
+        rebuild_balance(product_id)
+    db.session.commit()
+    print(f"Rebuilt balances for {len(product_ids)} products")
+
+@app.cli.command('snapshot-balances')
+def snapshot_balances():
+    """Write daily closing balances for every product up to yesterday"""
+    through_day = datetime.utcnow().date() - timedelta(days = 1)  # created_at is stored in UTC
+    product_ids = [row.id for row in db.session.query(Product.id)]
+    created = sum(snapshot_product(product_id, through_day) for product_id in product_ids)
+    db.session.commit()
+    print(f"Wrote {created} daily snapshots through {through_day}")
 
 
 if __name__ == '__main__' :
@@ -16,4 +16,30 @@ class StockMovement(db.Model):
     notes = db.Column(db.String(255), nullable =False)
     created_at = db.Column(db.DateTime(), default = db.func.current_timestamp())
     
-    product = db.relationship('Product', backref = 'movements')
\ No newline at end of file
+    product = db.relationship('Product', backref = 'movements')
+    
+    __table_args__ = (
+        db.Index('ix_stock_movement_product_created', 'product_id', 'created_at'),
+    )
+    
+class ProductBalance(db.Model):
+    # Running on-hand quantity per product, kept in step with StockMovement
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key = True)
+    quantity = db.Column(db.Integer, nullable = False, default = 0)
+    last_movement_id = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime(), default = db.func.current_timestamp(), onupdate = db.func.current_timestamp())
+    
+    product = db.relationship('Product', backref = db.backref('balance', uselist = False))
+
+
+class DailyBalance(db.Model):
+    # Closing quantity per product at the end of each day that had movements
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key = True)
+    day = db.Column(db.Date, primary_key = True)
+    closing_quantity = db.Column(db.Integer, nullable = False)
+    created_at = db.Column(db.DateTime(), default = db.func.current_timestamp())
+
+
+def signed_quantity(quantity, movement_type):
+    # stock_in adds to the shelf, everything else (sale, removal, return) takes from it
+    return quantity if movement_type == 'stock_in' else -quantity
@@ -0,0 +1,119 @@
+from datetime import datetime
+from sqlalchemy import func, select, update
+from app_factory import db
+from model import StoreInventory, ProductCatalog, ProductThreshold, CategoryThreshold, StockAlert
+from metrics import count_emit
+
+ALERTS_ROOM = 'alerts'
+
+
+def store_alerts_room(store_id):
+    return f"alerts_{store_id}"
+
+
+def effective_threshold(store_id, product_id):
+    """The (store, product) threshold, else the product's category threshold; takes columns or values"""
+    product = select(ProductThreshold.threshold).where(
+        ProductThreshold.store_id == store_id,
+        ProductThreshold.product_id == product_id
+    ).scalar_subquery()
+    category = select(CategoryThreshold.threshold).join(
+        ProductCatalog, ProductCatalog.category == CategoryThreshold.category
+    ).where(ProductCatalog.id == product_id).scalar_subquery()
+    return func.coalesce(product, category)
+
+
+def refresh_reorder_points(*criteria):
+    """Recompute store_inventory.reorder_point for the rows matching criteria after a threshold change"""
+    stmt = update(StoreInventory).where(*criteria).values(
+        reorder_point=effective_threshold(StoreInventory.store_id, StoreInventory.product_id)
+    )
+    return db.session.execute(stmt, execution_options={'synchronize_session': False}).rowcount
+
+
+def set_product_threshold(store_id, product_id, threshold):
+    """Upsert (or with None, remove) a (store, product) threshold and refresh that inventory row"""
+    from async_task import dialect_insert
+
+    if threshold is None:
+        ProductThreshold.query.filter_by(store_id=store_id, product_id=product_id).delete()
+    else:
+        stmt = dialect_insert(ProductThreshold).values(
+            store_id=store_id, product_id=product_id, threshold=threshold, updated_at=datetime.utcnow()
+        )
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['store_id', 'product_id'],
+            set_={'threshold': stmt.excluded.threshold, 'updated_at': stmt.excluded.updated_at}
+        ))
+    return refresh_reorder_points(StoreInventory.store_id == store_id, StoreInventory.product_id == product_id)
+
+
+def set_category_threshold(category, threshold):
+    """Upsert (or with None, remove) a category threshold and refresh the category's inventory rows"""
+    from async_task import dialect_insert
+
+    if threshold is None:
+        CategoryThreshold.query.filter_by(category=category).delete()
+    else:
+        stmt = dialect_insert(CategoryThreshold).values(
+            category=category, threshold=threshold, updated_at=datetime.utcnow()
+        )
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['category'],
+            set_={'threshold': stmt.excluded.threshold, 'updated_at': stmt.excluded.updated_at}
+        ))
+    # Rows with their own (store, product) threshold keep it, effective_threshold handles the precedence
+    return refresh_reorder_points(StoreInventory.product_id.in_(
+        select(ProductCatalog.id).where(ProductCatalog.category == category)
+    ))
+
+
+def threshold_crossings(rows, deltas):
+    """Alerts for existing rows whose quantity moved across their reorder point; rows come from the stock upsert"""
+    now = datetime.utcnow()
+    alerts = []
+    for key, row in rows.items():
+        threshold = row.reorder_point
+        if threshold is None:
+            continue
+        previous = row.quantity - deltas[key]
+        # A new row starts from nothing: it can open low, but has no earlier low to recover from
+        if (row.inserted or previous > threshold) and threshold >= row.quantity:
+            kind = 'low'
+        elif not row.inserted and previous <= threshold < row.quantity:
+            kind = 'recovered'
+        else:
+            continue
+        alerts.append({
+            'store_id': key[0],
+            'product_id': key[1],
+            'kind': kind,
+            'threshold': threshold,
+            'previous_quantity': previous,
+            'quantity': row.quantity,
+            'created_at': now
+        })
+    return alerts
+
+
+def record_threshold_alerts(rows, deltas):
+    """Insert alerts for any crossings in the current transaction, returns them for emit_alerts"""
+    alerts = threshold_crossings(rows, deltas)
+    if alerts:
+        db.session.execute(db.insert(StockAlert), alerts)
+    return alerts
+
+
+def alert_payload(alert):
+    return {**alert, 'created_at': alert['created_at'].isoformat()}
+
+
+def emit_alerts(alerts):
+    """Post-commit: push each alert to the all-stores room and its store's room"""
+    from app_factory import socketio
+
+    for alert in alerts:
+        payload = alert_payload(alert)
+        socketio.emit('stock_alert', payload, to=ALERTS_ROOM)
+        socketio.emit('stock_alert', payload, to=store_alerts_room(alert['store_id']))
+    count_emit('stock_alert', 2 * len(alerts))
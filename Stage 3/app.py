@@ -1,9 +1,18 @@
+import os
+
+# The dev server patches here; under gunicorn the eventlet worker patches itself (see gunicorn.conf.py)
+if __name__ == '__main__' and os.getenv('SOCKETIO_ASYNC_MODE', 'eventlet') == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+
+from green import patch_psycopg
 from app_factory import create_app, socketio
 from model import db
 
 app = create_app()
 
 if __name__ == '__main__':
+    patch_psycopg()
     with app.app_context():
         db.create_all()
     socketio.run(app, debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
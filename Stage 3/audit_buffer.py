@@ -0,0 +1,79 @@
+import os
+import json
+import uuid
+from datetime import datetime
+import redis
+from app_factory import redis_client
+
+# Entries are drained in batches of N, or every T ms by the beat schedule
+AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 500))
+AUDIT_FLUSH_INTERVAL_MS = int(os.environ.get('AUDIT_FLUSH_INTERVAL_MS', 1000))
+AUDIT_MAX_BATCHES = int(os.environ.get('AUDIT_MAX_BATCHES', 20))
+# Delivered but unacked entries older than this are reclaimed from dead consumers
+AUDIT_CLAIM_IDLE_MS = int(os.environ.get('AUDIT_CLAIM_IDLE_MS', 30000))
+
+STREAM_KEY = 'audit:stream'
+GROUP = 'audit-writers'
+
+_group_ready = False
+
+
+def ensure_group():
+    global _group_ready
+    if _group_ready:
+        return
+    try:
+        redis_client.xgroup_create(STREAM_KEY, GROUP, id='0', mkstream=True)
+    except redis.ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+    _group_ready = True
+
+
+def enqueue_audit(user_id, action, record_type, record_id, old_values=None, new_values=None, ip_address=None):
+    """Buffer an audit entry; event_id makes redelivery idempotent"""
+    entry = {
+        'event_id': uuid.uuid4().hex,
+        'user_id': user_id,
+        'action': action,
+        'record_type': record_type,
+        'record_id': record_id,
+        'old_values': old_values,
+        'new_values': new_values,
+        'ip_address': ip_address,
+        'created_at': datetime.utcnow().isoformat()
+    }
+    pipe = redis_client.pipeline()
+    pipe.xadd(STREAM_KEY, {'data': json.dumps(entry)})
+    pipe.xlen(STREAM_KEY)
+    _, length = pipe.execute()
+
+    if length % AUDIT_BATCH_SIZE == 0:
+        from async_task import drain_audit_buffer
+        drain_audit_buffer.delay()
+    return entry['event_id']
+
+
+def read_batch(consumer, count):
+    """Return (message_ids, entries), reclaiming stale deliveries before reading new ones"""
+    ensure_group()
+    claimed = redis_client.xautoclaim(STREAM_KEY, GROUP, consumer, AUDIT_CLAIM_IDLE_MS, start_id='0-0', count=count)
+    messages = [m for m in claimed[1] if m and m[1]]
+    if not messages:
+        response = redis_client.xreadgroup(GROUP, consumer, {STREAM_KEY: '>'}, count=count)
+        messages = response[0][1] if response else []
+
+    message_ids, entries = [], []
+    for message_id, fields in messages:
+        message_ids.append(message_id)
+        entry = json.loads(fields['data'])
+        entry['created_at'] = datetime.fromisoformat(entry['created_at'])
+        entries.append(entry)
+    return message_ids, entries
+
+
+def ack(message_ids):
+    pipe = redis_client.pipeline()
+    pipe.xack(STREAM_KEY, GROUP, *message_ids)
+    pipe.xdel(STREAM_KEY, *message_ids)
+    pipe.execute()
@@ -0,0 +1,232 @@
+import os
+import re
+import gzip
+import json
+import sys
+import logging
+from datetime import date, datetime
+from sqlalchemy import inspect, text
+from app_factory import db
+from model import AuditLog
+
+AUDIT_RETENTION_MONTHS = int(os.environ.get('AUDIT_RETENTION_MONTHS', 6))
+AUDIT_PARTITIONS_AHEAD = int(os.environ.get('AUDIT_PARTITIONS_AHEAD', 2))
+AUDIT_ARCHIVE_DIR = os.environ.get('AUDIT_ARCHIVE_DIR', os.path.join(os.path.dirname(__file__), 'archive', 'audit'))
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r'^audit_logs_y(\d{4})m(\d{2})$')
+# Where an audit_logs table from before partitioning is kept after its rows are copied over
+UNPARTITIONED_TABLE = 'audit_logs_unpartitioned'
+
+# Mirrors model.AuditLog; the primary key and event_id uniqueness must include the partition key
+PARTITIONED_DDL = """
+CREATE TABLE IF NOT EXISTS audit_logs (
+    id SERIAL,
+    user_id VARCHAR(64) NOT NULL,
+    action VARCHAR(32) NOT NULL,
+    record_type VARCHAR(32) NOT NULL,
+    record_id INTEGER NOT NULL,
+    old_values JSON,
+    new_values JSON,
+    ip_address VARCHAR(45),
+    created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    event_id VARCHAR(32),
+    PRIMARY KEY (id, created_at),
+    UNIQUE (event_id, created_at)
+) PARTITION BY RANGE (created_at)
+"""
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month_start):
+    return f"audit_logs_y{month_start.year:04d}m{month_start.month:02d}"
+
+
+def is_partitioned():
+    return db.session.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'audit_logs'::regclass)"
+    )).scalar()
+
+
+def set_aside_unpartitioned():
+    """Rename a plain audit_logs table, with its indexes and id sequence, out of the partitioned table's way"""
+    db.session.execute(text(f"ALTER TABLE audit_logs RENAME TO {UNPARTITIONED_TABLE}"))
+    sequence = db.session.execute(text(
+        f"SELECT pg_get_serial_sequence('{UNPARTITIONED_TABLE}', 'id')"
+    )).scalar()
+    if sequence:
+        db.session.execute(text(f"ALTER SEQUENCE {sequence} RENAME TO {UNPARTITIONED_TABLE}_id_seq"))
+    indexes = db.session.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table"
+    ), {'table': UNPARTITIONED_TABLE}).scalars().all()
+    for name in indexes:
+        # Also renames the primary key and unique constraints these indexes back
+        db.session.execute(text(f'ALTER INDEX "{name}" RENAME TO "{name[:50]}_unpartitioned"'))
+
+
+def copy_unpartitioned_rows():
+    """Copy the set-aside table's rows into audit_logs (they land in the default partition), returns the count"""
+    columns = [c['name'] for c in inspect(db.session.connection()).get_columns(UNPARTITIONED_TABLE)]
+    shared = [c.name for c in AuditLog.__table__.columns if c.name in columns]
+    # created_at had no database default before and is part of the partition key now
+    selected = [
+        "coalesce(created_at, now() AT TIME ZONE 'utc')" if name == 'created_at' else name for name in shared
+    ]
+    copied = db.session.execute(text(
+        f"INSERT INTO audit_logs ({', '.join(shared)}) SELECT {', '.join(selected)} FROM {UNPARTITIONED_TABLE}"
+    )).rowcount
+    db.session.execute(text(
+        "SELECT setval(pg_get_serial_sequence('audit_logs', 'id'), coalesce(max(id), 0) + 1, false) FROM audit_logs"
+    ))
+    return copied
+
+
+def create_partitioned_table():
+    """Create audit_logs as a range-partitioned table, migrating an unpartitioned one; call before db.create_all()"""
+    exists = db.session.execute(text("SELECT to_regclass('audit_logs') IS NOT NULL")).scalar()
+    migrate = exists and not is_partitioned()
+    if migrate:
+        if db.session.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {'name': UNPARTITIONED_TABLE}).scalar():
+            raise RuntimeError(
+                f"audit_logs is not partitioned and {UNPARTITIONED_TABLE} already exists from an earlier "
+                f"migration; drop or rename one of them first"
+            )
+        set_aside_unpartitioned()
+
+    db.session.execute(text(PARTITIONED_DDL))
+    db.session.execute(text("CREATE TABLE IF NOT EXISTS audit_logs_default PARTITION OF audit_logs DEFAULT"))
+    # Indexes on the parent cascade to every partition
+    for index in AuditLog.__table__.indexes:
+        index.create(db.session.connection(), checkfirst=True)
+    if migrate:
+        copied = copy_unpartitioned_rows()
+    # One transaction, so a failed migration leaves the original table where it was
+    db.session.commit()
+
+    if migrate:
+        months = partition_default_rows()
+        logger.warning(
+            "Migrated %d rows from unpartitioned audit_logs into %d monthly partitions; "
+            "the original is kept as %s and can be dropped", copied, len(months), UNPARTITIONED_TABLE
+        )
+    return True
+
+
+def this_month():
+    # created_at is stored in UTC, so month boundaries are UTC months
+    return datetime.utcnow().date().replace(day=1)
+
+
+def create_month_partition(start):
+    """Create the partition for start's month, moving any of its rows out of audit_logs_default first"""
+    name = partition_name(start)
+    if db.session.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {'name': name}).scalar():
+        return False
+    bounds = {'start': start, 'end': add_months(start, 1)}
+    in_default = db.session.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM audit_logs_default WHERE created_at >= :start AND created_at < :end)"
+    ), bounds).scalar()
+    for_values = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{bounds['end'].isoformat()}')"
+    if not in_default:
+        db.session.execute(text(f"CREATE TABLE {name} PARTITION OF audit_logs {for_values}"))
+    else:
+        # PARTITION OF would fail on the default partition's overlapping rows; attaching after the move doesn't
+        db.session.execute(text(f"CREATE TABLE {name} (LIKE audit_logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        db.session.execute(text(
+            f"WITH moved AS (DELETE FROM audit_logs_default WHERE created_at >= :start AND created_at < :end "
+            f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+        ), bounds)
+        db.session.execute(text(f"ALTER TABLE audit_logs ATTACH PARTITION {name} {for_values}"))
+    db.session.commit()
+    return True
+
+
+def ensure_partitions(months_ahead=AUDIT_PARTITIONS_AHEAD, since=None):
+    """Create monthly partitions from since (default: the current month) through months_ahead"""
+    start, last = (since or this_month()).replace(day=1), add_months(this_month(), months_ahead)
+    while start <= last:
+        create_month_partition(start)
+        start = add_months(start, 1)
+
+
+def partition_default_rows():
+    """Give every month that has rows in audit_logs_default its own partition, so they can be archived"""
+    months = db.session.execute(text(
+        "SELECT DISTINCT date_trunc('month', created_at)::date FROM audit_logs_default"
+    )).scalars().all()
+    for start in sorted(months):
+        create_month_partition(start)
+    return months
+
+
+def list_partitions():
+    """Monthly partition tables, attached or left detached by an interrupted archive run"""
+    names = db.session.execute(text(
+        "SELECT tablename FROM pg_tables WHERE schemaname = current_schema() AND tablename LIKE 'audit_logs_y%'"
+    )).scalars()
+    partitions = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions.append((date(int(match.group(1)), int(match.group(2)), 1), name))
+    return sorted(partitions)
+
+
+def export_partition(name, archive_dir):
+    """Stream a partition's rows into a gzipped NDJSON file, returns (path, row_count)"""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.ndjson.gz")
+    tmp_path = f"{path}.tmp"
+
+    count = 0
+    with db.engine.connect() as conn, gzip.open(tmp_path, 'wt', encoding='utf-8') as out:
+        result = conn.execution_options(yield_per=5000).execute(text(f"SELECT * FROM {name} ORDER BY created_at, id"))
+        for row in result.mappings():
+            out.write(json.dumps(dict(row), default=lambda v: v.isoformat() if isinstance(v, datetime) else str(v)))
+            out.write('\n')
+            count += 1
+    os.replace(tmp_path, path)
+    return path, count
+
+
+def archive_old_partitions(retention_months=AUDIT_RETENTION_MONTHS, archive_dir=AUDIT_ARCHIVE_DIR):
+    """Detach, export and drop partitions entirely older than the retention window"""
+    cutoff = add_months(this_month(), -retention_months)
+    partition_default_rows()
+    attached = set(db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'audit_logs'::regclass"
+    )).scalars())
+
+    archived = []
+    for month_start, name in list_partitions():
+        if add_months(month_start, 1) > cutoff:
+            continue
+        if name in attached:
+            # Detach first so /audit/logs stops reading it before the export starts
+            db.session.execute(text(f"ALTER TABLE audit_logs DETACH PARTITION {name}"))
+            db.session.commit()
+        path, count = export_partition(name, archive_dir)
+        db.session.execute(text(f"DROP TABLE {name}"))
+        db.session.commit()
+        archived.append({'partition': name, 'file': path, 'rows': count})
+    return archived
+
+
+if __name__ == '__main__':
+    from app_factory import create_app
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'maintain'
+    app = create_app(register_blueprints=False)
+    with app.app_context():
+        if command in ('ensure', 'maintain'):
+            ensure_partitions()
+            print("Partitions ensured")
+        if command in ('archive', 'maintain'):
+            for entry in archive_old_partitions():
+                print(f"Archived {entry['partition']}: {entry['rows']} rows -> {entry['file']}")
@@ -0,0 +1,456 @@
+"""Local benchmark for the Stage 3 API and its Celery pipeline.
+
+By default everything runs in this process: the app on a threaded werkzeug
+server, SQLite, fakeredis (from requirements-dev.txt) and Celery in eager
+mode. Point --db-uri/--redis-uri at a local Postgres/Redis, use --celery
+worker for an in-process worker, or --url to drive an already running stack.
+--server gunicorn runs the app under gunicorn.conf.py (eventlet workers,
+--preload) to compare green and blocking I/O:
+
+    python benchmark.py --server gunicorn --green off --auth basic --concurrency 64 --output results/blocking.json
+    python benchmark.py --server gunicorn --green on --auth basic --concurrency 64 --compare results/blocking.json
+
+    python benchmark.py --requests 2000 --concurrency 16 --output results/run.json
+    python benchmark.py --compare results/run.json
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from base64 import b64encode
+from collections import Counter
+from datetime import datetime
+from http.client import HTTPConnection
+from urllib.parse import urlparse
+
+SCENARIOS = ('stock_post', 'stock_get', 'audit_logs', 'register')
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, statuses, errors, elapsed):
+    latencies = sorted(latencies)
+    to_ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "statuses": dict(statuses),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": to_ms(percentile(latencies, 50)),
+        "p95_ms": to_ms(percentile(latencies, 95)),
+        "p99_ms": to_ms(percentile(latencies, 99)),
+        "max_ms": to_ms(latencies[-1] if latencies else None),
+    }
+
+
+class Client:
+    def __init__(self, base_url, auth_header=None):
+        parsed = urlparse(base_url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.prefix = parsed.path.rstrip('/')
+        self.auth_header = auth_header
+        self.conn = HTTPConnection(self.host, self.port, timeout=60)
+
+    def call(self, method, path, body=None, headers=None):
+        all_headers = {"Content-Type": "application/json"}
+        if self.auth_header:
+            all_headers["Authorization"] = self.auth_header
+        all_headers.update(headers or {})
+        payload = json.dumps(body) if body is not None else None
+        try:
+            self.conn.request(method, self.prefix + path, body=payload, headers=all_headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (ConnectionError, OSError):
+            # Server closed the connection (HTTP/1.0); reconnect once
+            self.conn.close()
+            self.conn = HTTPConnection(self.host, self.port, timeout=60)
+            self.conn.request(method, self.prefix + path, body=payload, headers=all_headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        return response.status, data
+
+
+def request_factory(name, args, run_id):
+    rng = random.Random(f"{args.seed}:{name}")
+    lock = threading.Lock()
+
+    def next_random():
+        with lock:
+            return rng.randint(1, args.stores), rng.randint(1, args.products), rng.choice([-3, -2, -1, 1, 2, 3, 5])
+
+    def make(index):
+        store_id, product_id, delta = next_random()
+        if name == 'stock_post':
+            return 'POST', '/stock', {"store_id": store_id, "product_id": product_id, "quantity": delta}
+        if name == 'stock_get':
+            return 'GET', f'/stock/{store_id}', None
+        if name == 'audit_logs':
+            return 'GET', '/audit/logs?per_page=50', None
+        return 'POST', '/register', {"username": f"bench_{run_id}_{index}", "password": "bench-pass"}
+    return make
+
+
+def run_scenario(name, base_url, auth_header, args, run_id):
+    make = request_factory(name, args, run_id)
+    counter = itertools.count()
+    latencies, statuses = [], Counter()
+    errors = [0]
+    lock = threading.Lock()
+
+    def worker():
+        client = Client(base_url, None if name == 'register' else auth_header)
+        while True:
+            index = next(counter)
+            if index >= args.requests:
+                return
+            method, path, body = make(index)
+            started = time.perf_counter()
+            try:
+                status, _ = client.call(method, path, body)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                continue
+            elapsed = time.perf_counter() - started
+            with lock:
+                statuses[status] += 1
+                if status >= 500:
+                    errors[0] += 1
+                else:
+                    latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, statuses, errors[0], time.perf_counter() - started)
+
+
+def current_quantity(client, store_id, product_id):
+    status, data = client.call('GET', f'/stock/{store_id}')
+    if status != 200:
+        return None
+    for item in json.loads(data):
+        if item["product_id"] == product_id:
+            return item["quantity"]
+    return 0
+
+
+def run_visibility(base_url, auth_header, args):
+    """Time from POST /stock to the new quantity showing up in GET /stock for the same client"""
+    rng = random.Random(f"{args.seed}:visibility")
+    client = Client(base_url, auth_header)
+    latencies, timeouts = [], 0
+    for _ in range(args.visibility_samples):
+        store_id, product_id = rng.randint(1, args.stores), rng.randint(1, args.products)
+        before = current_quantity(client, store_id, product_id) or 0
+        started = time.perf_counter()
+        client.call('POST', '/stock', {"store_id": store_id, "product_id": product_id, "quantity": 1})
+        while True:
+            if current_quantity(client, store_id, product_id) == before + 1:
+                latencies.append(time.perf_counter() - started)
+                break
+            if time.perf_counter() - started > args.visibility_timeout:
+                timeouts += 1
+                break
+            time.sleep(0.005)
+    summary = summarize(latencies, Counter(), timeouts, sum(latencies) or 1)
+    summary.pop("throughput_rps")
+    summary["timeouts"] = summary.pop("errors")
+    return summary
+
+
+def seed_database(args, db_uri):
+    from generate_data import run_chunk, truncate
+
+    truncate(db_uri)
+    config = {
+        'seed': args.seed, 'stores': args.stores, 'products': args.products,
+        'skus_per_store': args.products, 'users': 10, 'history_days': 30,
+        'end_date': datetime(2025, 1, 1),
+    }
+    for table, total in (('stores', args.stores), ('product_catalog', args.products),
+                         ('store_inventory', args.stores), ('audit_logs', args.audit_rows)):
+        if total:
+            run_chunk((db_uri, table, config, 0, total))
+
+
+def start_celery_worker(args, **conf):
+    import async_task
+    from celery.contrib.testing.worker import start_worker
+
+    async_task.celery.conf.update(**conf)
+    worker = start_worker(async_task.celery, pool='threads', concurrency=args.worker_concurrency,
+                          perform_ping_check=False, loglevel='WARNING')
+    worker.__enter__()
+    return worker
+
+
+def start_local_stack(args):
+    """App on a background werkzeug server with SQLite/fakeredis/eager Celery unless told otherwise"""
+    import redis
+    from werkzeug.serving import make_server
+
+    db_uri = args.db_uri or f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bazaar-bench-'), 'bench.db')}"
+    os.environ['SOCKETIO_ASYNC_MODE'] = 'threading'
+
+    if args.redis_uri:
+        redis_client = redis.Redis.from_url(args.redis_uri, decode_responses=True)
+    else:
+        import fakeredis
+        redis_client = fakeredis.FakeRedis(decode_responses=True)
+
+    import async_task
+    from app_factory import create_app, db
+
+    app = create_app(config={
+        'SQLALCHEMY_DATABASE_URI': db_uri,
+        'REPLICA_URIS': [db_uri],
+        'REDIS_CLIENT': redis_client,
+        'CACHE_TYPE': 'RedisCache' if args.redis_uri else 'SimpleCache',
+        'CACHE_REDIS_URL': args.redis_uri,
+        'SOCKETIO_MESSAGE_QUEUE': args.redis_uri,
+        'RATELIMIT_ENABLED': False,
+        'RATELIMIT_STORAGE_URI': 'memory://',
+    })
+    # Tasks run inside this app instead of building their own
+    async_task.flask_app = app
+
+    with app.app_context():
+        db.create_all()
+    seed_database(args, db_uri)
+
+    worker = None
+    if args.celery == 'eager':
+        async_task.celery.conf.task_always_eager = True
+    else:
+        worker = start_celery_worker(args, broker_url='memory://', result_backend='cache+memory://',
+                                     broker_transport_options={'polling_interval': 0.01})
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop():
+        server.shutdown()
+        if worker:
+            worker.__exit__(None, None, None)
+    return f"http://127.0.0.1:{server.server_port}", db_uri, stop
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if Client(base_url).call('GET', '/health')[0] in (200, 500):
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"{base_url} did not come up within {timeout}s")
+
+
+def start_gunicorn_stack(args):
+    """The app under gunicorn.conf.py (eventlet workers, --preload) in a subprocess; Celery runs here"""
+    db_uri = args.db_uri or f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bazaar-bench-'), 'bench.db')}"
+    redis_uri, stop_redis = args.redis_uri, None
+    if not redis_uri:
+        # Both processes need the same Redis, so serve fakeredis over TCP
+        from fakeredis import TcpFakeServer
+        redis_server = TcpFakeServer(('127.0.0.1', free_port()), server_type='redis')
+        redis_server.daemon_threads = True
+        threading.Thread(target=redis_server.serve_forever, daemon=True).start()
+        redis_uri = f"redis://127.0.0.1:{redis_server.server_address[1]}/0"
+        stop_redis = redis_server.shutdown
+
+    port = free_port()
+    env = {
+        'DB_URI': db_uri,
+        'REPLICA_URIS': db_uri,
+        'REDIS_URI': redis_uri,
+        'CELERY_BROKER': redis_uri,
+        'CELERY_BACKEND': redis_uri,
+        'RATELIMIT_ENABLED': 'false',
+        'RATELIMIT_STORAGE_URI': 'memory://',
+    }
+    # The Celery app reads these at import time, create_app when it runs
+    os.environ.update(env)
+    os.environ['SOCKETIO_ASYNC_MODE'] = 'threading'
+
+    import async_task
+    import model  # registers the tables for create_all
+    from app_factory import create_app, db
+
+    app = create_app(register_blueprints=False)
+    async_task.flask_app = app
+    with app.app_context():
+        db.create_all()
+    seed_database(args, db_uri)
+    worker = start_celery_worker(args, broker_url=redis_uri, result_backend=redis_uri)
+
+    server = subprocess.Popen(
+        ['gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env={**os.environ, **env,
+             'SOCKETIO_ASYNC_MODE': 'eventlet',
+             'GREEN_IO': 'true' if args.green == 'on' else 'false',
+             'WEB_CONCURRENCY': str(args.web_workers),
+             'GUNICORN_BIND': f'127.0.0.1:{port}'}
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_up(base_url)
+    except SystemExit:
+        server.terminate()
+        raise
+
+    def stop():
+        # Quick shutdown: a graceful one waits out the benchmark's keep-alive connections
+        server.send_signal(signal.SIGINT)
+        server.wait(timeout=30)
+        worker.__exit__(None, None, None)
+        if stop_redis:
+            stop_redis()
+    return base_url, db_uri, stop
+
+
+def obtain_auth_header(base_url, args):
+    basic = "Basic " + b64encode(f"{args.username}:{args.password}".encode()).decode()
+    client = Client(base_url)
+    client.call('POST', '/register', {"username": args.username, "password": args.password})
+    if args.auth == 'basic':
+        return basic
+    status, data = client.call('POST', '/token', headers={"Authorization": basic})
+    if status != 200:
+        raise SystemExit(f"Could not get a token ({status}): {data[:200]}")
+    return f"Bearer {json.loads(data)['token']}"
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)), text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} ({baseline['meta'].get('git_revision')})")
+    for name, result in current["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if not before:
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            old, new = before.get(metric), result.get(metric)
+            if old and new is not None:
+                print(f"  {name:<12} {metric:<15} {old:>10} -> {new:>10} ({(new - old) / old * 100:+.1f}%)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the Stage 3 API locally")
+    parser.add_argument('--url', help="benchmark a running stack instead of an in-process app")
+    parser.add_argument('--db-uri', help="defaults to a fresh SQLite file")
+    parser.add_argument('--redis-uri', help="defaults to fakeredis")
+    parser.add_argument('--celery', choices=('eager', 'worker'), default='eager',
+                        help="in-process server only; gunicorn always uses a worker")
+    parser.add_argument('--server', choices=('inprocess', 'gunicorn'), default='inprocess')
+    parser.add_argument('--web-workers', type=int, default=2, help="gunicorn workers")
+    parser.add_argument('--green', choices=('on', 'off'), default='on',
+                        help="gunicorn only: green psycopg2 waits and threaded password hashing")
+    parser.add_argument('--worker-concurrency', type=int, default=4)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500, help="per scenario")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--visibility-samples', type=int, default=50)
+    parser.add_argument('--visibility-timeout', type=float, default=10)
+    parser.add_argument('--stores', type=int, default=50)
+    parser.add_argument('--products', type=int, default=40)
+    parser.add_argument('--audit-rows', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--auth', choices=('token', 'basic'), default='token')
+    parser.add_argument('--username', default='bench')
+    parser.add_argument('--password', default='bench-pass')
+    parser.add_argument('--output', help="write results as JSON")
+    parser.add_argument('--compare', help="previous results JSON to diff against")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    stop = None
+    if args.url:
+        base_url, db_uri = args.url, None
+    elif args.server == 'gunicorn':
+        base_url, db_uri, stop = start_gunicorn_stack(args)
+    else:
+        base_url, db_uri, stop = start_local_stack(args)
+
+    run_id = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    results = {
+        "meta": {
+            "run_id": run_id,
+            "git_revision": git_revision(),
+            "target": args.url or args.server,
+            "db": db_uri.split(':', 1)[0] if db_uri else None,
+            "redis": "redis" if args.redis_uri else ("fakeredis" if not args.url else None),
+            "celery": None if args.url else ("worker" if args.server == 'gunicorn' else args.celery),
+            "web_workers": args.web_workers if args.server == 'gunicorn' and not args.url else None,
+            "green_io": args.green if args.server == 'gunicorn' and not args.url else None,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "auth": args.auth,
+        },
+        "scenarios": {}
+    }
+    try:
+        auth_header = obtain_auth_header(base_url, args)
+        for name in [s.strip() for s in args.scenarios.split(',') if s.strip()]:
+            result = run_scenario(name, base_url, auth_header, args, run_id)
+            results["scenarios"][name] = result
+            print(f"{name:<12} {result['throughput_rps']:>9} req/s  p50 {result['p50_ms']} ms  "
+                  f"p95 {result['p95_ms']} ms  p99 {result['p99_ms']} ms  errors {result['errors']}")
+        if args.visibility_samples:
+            result = run_visibility(base_url, auth_header, args)
+            results["scenarios"]["update_to_visible"] = result
+            print(f"{'update_to_visible':<12} p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms  "
+                  f"p99 {result['p99_ms']} ms  timeouts {result['timeouts']}")
+    finally:
+        if stop:
+            stop()
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import os
+import time
+import uuid
+from app_factory import redis_client
+
+# Opt-in: hot (store, product) deltas are summed in Redis and applied once per window
+COALESCE_ENABLED = os.environ.get('STOCK_COALESCE', 'false').lower() in ('1', 'true', 'yes')
+MAX_STALENESS = float(os.environ.get('STOCK_COALESCE_MAX_STALENESS', 5))
+WINDOW = min(float(os.environ.get('STOCK_COALESCE_WINDOW', 1)), MAX_STALENESS)
+
+PENDING_KEY = 'stock:pending:{}'
+WINDOWS_KEY = 'stock:pending:windows'
+FLUSHING_KEY = 'stock:flushing'
+CLAIM_LOCK_KEY = 'stock:flushing:lock:{}'
+# A claim whose flusher died is picked up by another one once this lease runs out
+CLAIM_LEASE = int(os.environ.get('STOCK_COALESCE_CLAIM_LEASE', 60))
+
+# Rename, drop the pending TTL, register and lock in one step, so a crash can't leave a half-made claim
+CLAIM_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('PERSIST', KEYS[2])
+redis.call('SADD', KEYS[3], KEYS[2])
+redis.call('SET', KEYS[4], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+
+
+def current_window(now=None):
+    return int((now or time.time()) // WINDOW)
+
+
+def buffer_stock_delta(store_id, product_id, quantity_change, user_id=None):
+    """Add a delta to the open window, returns (window, is_new_window)"""
+    window = current_window()
+    field = f"{store_id}:{product_id}"
+
+    pipe = redis_client.pipeline()
+    pipe.hincrby(PENDING_KEY.format(window), field, quantity_change)
+    pipe.hincrby(PENDING_KEY.format(window), f"{field}:n", 1)
+    if user_id:
+        # Writers of the window, so the flush can hand their reads back to the replica after commit
+        pipe.hset(PENDING_KEY.format(window), f"u:{user_id}", 1)
+    pipe.expire(PENDING_KEY.format(window), int(MAX_STALENESS * 20) + 60)
+    pipe.zadd(WINDOWS_KEY, {window: window}, nx=True)
+    results = pipe.execute()
+
+    return window, bool(results[-1])
+
+
+def claim_closed_windows():
+    """Move every closed window's hash to a flushing key so late writers start a fresh one; returns our claims"""
+    closed = redis_client.zrangebyscore(WINDOWS_KEY, '-inf', current_window() - 1)
+    claims = []
+    for window in closed:
+        # Drop the marker first: a write landing after this re-registers the window
+        redis_client.zrem(WINDOWS_KEY, window)
+        claimed = f"stock:flushing:{window}:{uuid.uuid4().hex[:8]}"
+        keys = [PENDING_KEY.format(window), claimed, FLUSHING_KEY, CLAIM_LOCK_KEY.format(claimed)]
+        # Nothing buffered, or another flusher got there first
+        if redis_client.eval(CLAIM_SCRIPT, len(keys), *keys, os.getpid(), CLAIM_LEASE * 1000):
+            claims.append(claimed)
+    return claims
+
+
+def recover_orphaned_claims():
+    """Claims left behind by a flusher that died or failed, each taken only once its lease is free"""
+    return [claimed for claimed in redis_client.smembers(FLUSHING_KEY)
+            if redis_client.set(CLAIM_LOCK_KEY.format(claimed), os.getpid(), nx=True, px=CLAIM_LEASE * 1000)]
+
+
+def read_claimed(claimed):
+    """Return ({(store_id, product_id): delta}, {(store_id, product_id): update_count}, writer user ids)"""
+    deltas, counts, users = {}, {}, []
+    for field, value in redis_client.hgetall(claimed).items():
+        if field.startswith('u:'):
+            users.append(field[2:])
+            continue
+        parts = field.split(':')
+        key = (int(parts[0]), int(parts[1]))
+        if len(parts) == 3:
+            counts[key] = int(value)
+        else:
+            deltas[key] = int(value)
+    return deltas, counts, users
+
+
+def release_claimed(claimed):
+    pipe = redis_client.pipeline()
+    pipe.delete(claimed)
+    pipe.srem(FLUSHING_KEY, claimed)
+    pipe.delete(CLAIM_LOCK_KEY.format(claimed))
+    pipe.execute()
@@ -1,13 +1,65 @@
 from app_factory import create_app, db
 from model import User, Store, ProductCatalog, StoreInventory
+from audit_partitions import create_partitioned_table, ensure_partitions, is_partitioned
+from product_search import ensure_search_indexes
+from sqlalchemy import inspect, text
 import time
 
+def ensure_inventory_unique():
+    """Merge duplicate (store_id, product_id) rows and add the unique constraint on databases created before it existed"""
+    constraints = inspect(db.engine).get_unique_constraints('store_inventory')
+    if any(c['name'] == 'uq_store_inventory_store_product' for c in constraints):
+        return
+    
+    db.session.execute(text("""
+        WITH dupes AS (
+            SELECT store_id, product_id, MIN(id) AS keep_id, SUM(quantity) AS total
+            FROM store_inventory GROUP BY store_id, product_id HAVING COUNT(*) > 1
+        )
+        UPDATE store_inventory SET quantity = dupes.total
+        FROM dupes WHERE store_inventory.id = dupes.keep_id
+    """))
+    db.session.execute(text("""
+        DELETE FROM store_inventory WHERE id NOT IN (
+            SELECT MIN(id) FROM store_inventory GROUP BY store_id, product_id
+        )
+    """))
+    db.session.execute(text(
+        "ALTER TABLE store_inventory ADD CONSTRAINT uq_store_inventory_store_product UNIQUE (store_id, product_id)"
+    ))
+    db.session.commit()
+
+def ensure_audit_event_id():
+    """Add the audit buffer's dedupe column to audit_logs tables created before it existed"""
+    columns = [c['name'] for c in inspect(db.engine).get_columns('audit_logs')]
+    if 'event_id' in columns:
+        return
+    db.session.execute(text("ALTER TABLE audit_logs ADD COLUMN event_id VARCHAR(32) UNIQUE"))
+    db.session.commit()
+
+def ensure_inventory_reorder_point():
+    """Add the denormalized low-stock threshold to store_inventory tables created before it existed"""
+    columns = [c['name'] for c in inspect(db.engine).get_columns('store_inventory')]
+    if 'reorder_point' in columns:
+        return
+    db.session.execute(text("ALTER TABLE store_inventory ADD COLUMN reorder_point INTEGER"))
+    db.session.commit()
+
 def setup_database():
     """Create database tables and seed with initial data"""
     app = create_app(register_blueprints=False)
     
     with app.app_context():
+        if db.engine.dialect.name == 'postgresql':
+            create_partitioned_table()
         db.create_all()
+        if db.engine.dialect.name == 'postgresql':
+            ensure_inventory_unique()
+            ensure_audit_event_id()
+            ensure_inventory_reorder_point()
+            ensure_search_indexes()
+            if is_partitioned():
+                ensure_partitions()
         
         admin = User.query.filter_by(username='asghar').first()
         if not admin:
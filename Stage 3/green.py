@@ -0,0 +1,75 @@
+import os
+import sys
+
+# Set GREEN_IO=false to compare against blocking database calls and password hashing on the hub
+GREEN_IO = os.environ.get('GREEN_IO', 'true').lower() in ('1', 'true', 'yes')
+
+
+def green_hub():
+    """'eventlet' or 'gevent' when that library has patched the socket module, otherwise None"""
+    if 'eventlet' in sys.modules:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('socket'):
+            return 'eventlet'
+    if 'gevent' in sys.modules:
+        from gevent import monkey
+        if monkey.is_module_patched('socket'):
+            return 'gevent'
+    return None
+
+
+def eventlet_wait_callback(conn, timeout=-1):
+    from eventlet.hubs import trampoline
+    from psycopg2 import OperationalError, extensions
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            return
+        elif state == extensions.POLL_READ:
+            trampoline(conn.fileno(), read=True)
+        elif state == extensions.POLL_WRITE:
+            trampoline(conn.fileno(), write=True)
+        else:
+            raise OperationalError(f"Bad result from poll: {state!r}")
+
+
+def gevent_wait_callback(conn, timeout=None):
+    from gevent.socket import wait_read, wait_write
+    from psycopg2 import OperationalError, extensions
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            return
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise OperationalError(f"Bad result from poll: {state!r}")
+
+
+def patch_psycopg():
+    """Make psycopg2 yield to the hub while it waits on Postgres instead of blocking the whole worker"""
+    hub = green_hub()
+    if not GREEN_IO or hub is None:
+        return False
+    try:
+        from psycopg2 import extensions
+    except ImportError:
+        return False
+    extensions.set_wait_callback(eventlet_wait_callback if hub == 'eventlet' else gevent_wait_callback)
+    return True
+
+
+def offload(fn, *args):
+    """Run CPU-bound work (password hashing) in a native thread so other green threads keep running"""
+    hub = green_hub() if GREEN_IO else None
+    if hub == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(fn, *args)
+    if hub == 'gevent':
+        from gevent import get_hub
+        return get_hub().threadpool.apply(fn, args)
+    return fn(*args)
@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+
+# Several eventlet workers sharing one port; Socket.IO rooms and emits go through the Redis message queue
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'eventlet')
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+# Import the app once in the master; workers fork from it and reset what they inherited
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+if preload_app:
+    # Tells create_app to leave background tasks to the workers (see post_worker_init)
+    os.environ['WEB_PRELOADED'] = 'true'
+
+if workers > 1:
+    # Long-polling needs every request of a session on the same worker, which gunicorn can't guarantee
+    os.environ.setdefault('SOCKETIO_TRANSPORTS', 'websocket')
+    # Each worker keeps its own metric values; /metrics must sum them, not report whichever worker answered
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'bazaar-prometheus'))
+
+if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+    # Set before prometheus_client is imported (--preload imports it right after this file);
+    # files left by a previous run would be added to this one's totals
+    shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+
+def post_worker_init(worker):
+    # Runs after the eventlet worker has monkey-patched itself. The master is never patched:
+    # a patched arbiter stops handling signals, so --preload imports the app unpatched.
+    from green import patch_psycopg
+    patch_psycopg()
+    if preload_app:
+        from app import app
+        from app_factory import reset_after_fork
+        reset_after_fork(app)
+
+
+def child_exit(server, worker):
+    # Drop the dead worker's live gauges; its counters and histograms stay in the totals
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,315 @@
+"""Bulk inventory import: stream-parse CSV/NDJSON, stage in chunks, merge with one upsert.
+
+    python inventory_import.py stocktake.csv --mode absolute
+    python inventory_import.py deliveries.ndjson --mode delta --on-error abort
+"""
+import argparse
+import codecs
+import csv
+import io
+import json
+import os
+import sys
+from datetime import datetime
+from sqlalchemy import Column, Integer, MetaData, Table, and_, case, func, literal, or_, select, true
+from app_factory import db
+from model import StoreInventory, StockAlert
+
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 5000))
+IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS', 1000))
+# Above this many merged rows subscribers get a stock_reload per store instead of per-product diffs
+IMPORT_LIVE_MAX = int(os.environ.get('IMPORT_LIVE_MAX', 50000))
+
+MODES = ('absolute', 'delta')
+FORMATS = ('csv', 'ndjson')
+FIELDS = ('store_id', 'product_id', 'quantity')
+
+# Per-connection temporary table; line numbers point errors and "last row wins" back at the file
+staging = Table(
+    'inventory_import_staging', MetaData(),
+    Column('line', Integer, nullable=False),
+    Column('store_id', Integer, nullable=False),
+    Column('product_id', Integer, nullable=False),
+    Column('quantity', Integer, nullable=False),
+    prefixes=['TEMPORARY']
+)
+
+
+class ImportReport:
+    def __init__(self, mode):
+        self.mode = mode
+        self.rows = 0
+        self.staged = 0
+        self.rejected = 0
+        self.errors = []
+        self.merged = 0
+        self.stores = 0
+        self.alerts = 0
+        self.applied = False
+
+    def reject(self, line, error):
+        self.rejected += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({'line': line, 'error': error})
+
+    def as_dict(self):
+        return {
+            'mode': self.mode,
+            'applied': self.applied,
+            'rows': self.rows,
+            'staged': self.staged,
+            'rejected': self.rejected,
+            'merged': self.merged,
+            'stores': self.stores,
+            'alerts': self.alerts,
+            # Unknown store/product errors are found a chunk later than parse errors
+            'errors': sorted(self.errors, key=lambda error: error['line']),
+            'errors_truncated': self.rejected > len(self.errors)
+        }
+
+
+def parse_rows(stream, fmt):
+    """Yield (line, record) from a binary stream without reading it all; record is a dict or an error string"""
+    text_stream = codecs.getreader('utf-8')(stream, errors='replace')
+    if fmt == 'csv':
+        reader = csv.DictReader(text_stream)
+        missing = [field for field in FIELDS if field not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"CSV header is missing: {', '.join(missing)}")
+        for record in reader:
+            # Header is line 1
+            yield reader.line_num, record
+    else:
+        for line, raw in enumerate(text_stream, start=1):
+            if not raw.strip():
+                continue
+            try:
+                record = json.loads(raw)
+            except ValueError:
+                yield line, "Invalid JSON"
+                continue
+            yield line, record if isinstance(record, dict) else "Expected a JSON object"
+
+
+def validate_record(record, mode):
+    """Return (store_id, product_id, quantity) or raise ValueError with the reason"""
+    if isinstance(record, str):
+        raise ValueError(record)
+    try:
+        values = tuple(int(record[field]) for field in FIELDS)
+    except KeyError as e:
+        raise ValueError(f"Missing {e.args[0]}")
+    except (TypeError, ValueError):
+        raise ValueError("store_id, product_id and quantity must be integers")
+    if mode == 'absolute' and values[2] < 0:
+        raise ValueError("quantity must be >= 0 in absolute mode")
+    return values
+
+
+def copy_chunk(connection, rows):
+    """COPY into the staging table on Postgres, plain executemany elsewhere"""
+    if connection.dialect.name == 'postgresql' and not green_waits_enabled():
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        with connection.connection.dbapi_connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {staging.name} (line, store_id, product_id, quantity) FROM STDIN WITH (FORMAT csv)", buffer
+            )
+    else:
+        connection.execute(staging.insert(), [
+            {'line': line, 'store_id': store_id, 'product_id': product_id, 'quantity': quantity}
+            for line, store_id, product_id, quantity in rows
+        ])
+
+
+def green_waits_enabled():
+    # psycopg2 can't COPY while a wait callback is registered (see green.py)
+    try:
+        from psycopg2 import extensions
+    except ImportError:
+        return False
+    return extensions.get_wait_callback() is not None
+
+
+def stage_chunk(connection, chunk, report):
+    """Drop rows for unknown stores/products, then stage the rest"""
+    from async_task import known_inventory_keys
+
+    known = known_inventory_keys({(store_id, product_id) for _, store_id, product_id, _ in chunk})
+    rows = []
+    for line, store_id, product_id, quantity in chunk:
+        if (store_id, product_id) in known:
+            rows.append((line, store_id, product_id, quantity))
+        else:
+            report.reject(line, "Unknown store or product")
+    if rows:
+        copy_chunk(connection, rows)
+        report.staged += len(rows)
+
+
+def incoming_rows(mode):
+    """One row per (store, product): the last line in absolute mode, the summed deltas otherwise"""
+    if mode == 'absolute':
+        last_lines = select(func.max(staging.c.line)).group_by(staging.c.store_id, staging.c.product_id)
+        return select(staging.c.store_id, staging.c.product_id, staging.c.quantity).where(
+            staging.c.line.in_(last_lines)
+        ).subquery('incoming')
+    return select(
+        staging.c.store_id, staging.c.product_id, func.sum(staging.c.quantity).label('quantity')
+    ).group_by(staging.c.store_id, staging.c.product_id).subquery('incoming')
+
+
+def record_import_alerts(incoming, mode, now):
+    """Set-based version of alerts.threshold_crossings, run before the merge while old quantities exist"""
+    inventory = StoreInventory.__table__
+    old, point = inventory.c.quantity, inventory.c.reorder_point
+    new = incoming.c.quantity if mode == 'absolute' else old + incoming.c.quantity
+    crossings = select(
+        inventory.c.store_id,
+        inventory.c.product_id,
+        case((new <= point, 'low'), else_='recovered'),
+        point,
+        old,
+        new,
+        literal(now)
+    ).join(incoming, and_(
+        incoming.c.store_id == inventory.c.store_id,
+        incoming.c.product_id == inventory.c.product_id
+    )).where(point.isnot(None), or_(and_(old > point, new <= point), and_(old <= point, new > point)))
+
+    stmt = db.insert(StockAlert).from_select(
+        ['store_id', 'product_id', 'kind', 'threshold', 'previous_quantity', 'quantity', 'created_at'], crossings
+    ).returning(StockAlert.store_id, StockAlert.product_id, StockAlert.kind, StockAlert.threshold,
+                StockAlert.previous_quantity, StockAlert.quantity, StockAlert.created_at)
+    return [dict(row._mapping) for row in db.session.execute(stmt)]
+
+
+def merge_staged(mode, now, want_rows):
+    """Single INSERT ... SELECT ... ON CONFLICT from the staging table into store_inventory"""
+    from async_task import dialect_insert
+    from alerts import effective_threshold
+
+    incoming = incoming_rows(mode)
+    source = select(
+        incoming.c.store_id,
+        incoming.c.product_id,
+        incoming.c.quantity,
+        literal(now),
+        effective_threshold(incoming.c.store_id, incoming.c.product_id)
+    ).where(true())  # SQLite needs an explicit WHERE to parse INSERT ... SELECT ... ON CONFLICT
+    stmt = dialect_insert(StoreInventory).from_select(
+        ['store_id', 'product_id', 'quantity', 'last_updated', 'reorder_point'], source
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['store_id', 'product_id'],
+        set_={
+            'quantity': stmt.excluded.quantity if mode == 'absolute' else StoreInventory.quantity + stmt.excluded.quantity,
+            'last_updated': stmt.excluded.last_updated
+        }
+    )
+    if not want_rows:
+        return db.session.execute(stmt).rowcount, None
+    stmt = stmt.returning(StoreInventory.store_id, StoreInventory.product_id, StoreInventory.quantity)
+    rows = {(row.store_id, row.product_id): row for row in db.session.execute(stmt)}
+    return len(rows), rows
+
+
+def import_inventory(stream, fmt, mode, user_id="system", abort_on_error=False):
+    """Stream, validate and stage a file, then merge it in the same transaction; returns an ImportReport"""
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+
+    report = ImportReport(mode)
+    connection = db.session.connection()
+    staging.drop(connection, checkfirst=True)
+    staging.create(connection)
+    try:
+        chunk = []
+        for line, record in parse_rows(stream, fmt):
+            report.rows += 1
+            try:
+                chunk.append((line, *validate_record(record, mode)))
+            except ValueError as e:
+                report.reject(line, str(e))
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                stage_chunk(connection, chunk, report)
+                chunk = []
+        if chunk:
+            stage_chunk(connection, chunk, report)
+
+        if report.staged == 0 or (abort_on_error and report.rejected):
+            db.session.rollback()
+            return report
+
+        now = datetime.utcnow()
+        alerts = record_import_alerts(incoming_rows(mode), mode, now)
+        store_ids = list(db.session.execute(select(staging.c.store_id).distinct()).scalars())
+        report.merged, rows = merge_staged(mode, now, want_rows=report.staged <= IMPORT_LIVE_MAX)
+        staging.drop(connection)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    report.applied = True
+    report.stores = len(store_ids)
+    report.alerts = len(alerts)
+    after_import(report, store_ids, rows, alerts, user_id)
+    return report
+
+
+def after_import(report, store_ids, rows, alerts, user_id):
+    """Post-commit fan-out, the bulk counterpart of async_task.emit_stock_updates"""
+    from app_factory import socketio
+    from alerts import emit_alerts
+    from audit_buffer import enqueue_audit
+    from live_updates import queue_stock_changes, store_room
+    from metrics import count_emit
+    from read_routing import mark_committed_write
+    from stock_cache import invalidate_store_stock
+
+    mark_committed_write(user_id)
+    invalidate_store_stock(store_ids)
+    if rows is not None:
+        queue_stock_changes(rows)
+    else:
+        for store_id in store_ids:
+            socketio.emit('stock_reload', {'store_id': store_id}, to=store_room(store_id))
+        count_emit('stock_reload', len(store_ids))
+    emit_alerts(alerts)
+
+    # One audit entry per import rather than one per row
+    enqueue_audit(
+        user_id=user_id,
+        action="inventory_import",
+        record_type="inventory",
+        record_id=0,
+        new_values={k: v for k, v in report.as_dict().items() if k not in ('errors', 'errors_truncated')}
+    )
+
+
+if __name__ == '__main__':
+    from app_factory import create_app
+
+    parser = argparse.ArgumentParser(description="Import inventory counts or deltas from CSV/NDJSON")
+    parser.add_argument('path', help="file to import, - for stdin")
+    parser.add_argument('--mode', choices=MODES, default='absolute')
+    parser.add_argument('--format', choices=FORMATS, help="defaults to the file extension")
+    parser.add_argument('--on-error', choices=('skip', 'abort'), default='skip')
+    parser.add_argument('--user', default='import-cli')
+    args = parser.parse_args()
+
+    fmt = args.format or ('ndjson' if args.path.endswith(('.ndjson', '.jsonl')) else 'csv')
+    app = create_app(register_blueprints=False)
+    with app.app_context():
+        stream = sys.stdin.buffer if args.path == '-' else open(args.path, 'rb')
+        try:
+            report = import_inventory(stream, fmt, args.mode, user_id=args.user,
+                                      abort_on_error=args.on_error == 'abort')
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+    print(json.dumps(report.as_dict(), indent=2))
@@ -0,0 +1,153 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from app_factory import redis_client
+from metrics import count_emit
+
+# Each room gets at most one frame per interval, carrying the latest quantity of everything that changed
+LIVE_UPDATE_INTERVAL = float(os.environ.get('LIVE_UPDATE_INTERVAL', 0.25))
+LIVE_MAX_PRODUCT_SET = int(os.environ.get('LIVE_MAX_PRODUCT_SET', 5000))
+# Registered product sets are forgotten after a day without a new subscriber
+LIVE_SET_TTL = int(os.environ.get('LIVE_SET_TTL', 86400))
+
+PENDING_KEY = 'live:pending:{}'
+DIRTY_KEY = 'live:dirty'
+SETS_KEY = 'live:sets:{}'
+FLUSH_LOCK_KEY = 'live:flush:lock'
+
+logger = logging.getLogger(__name__)
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def after_fork():
+    """Fresh lock and flusher state for a forked worker"""
+    global _flusher_pid, _flusher_lock
+    _flusher_pid = None
+    _flusher_lock = threading.Lock()
+
+
+def store_room(store_id):
+    return f"store_{store_id}"
+
+
+def product_room(store_id, product_id):
+    return f"stock_{store_id}_{product_id}"
+
+
+def product_set_room(store_id, set_id):
+    return f"stock_set_{store_id}_{set_id}"
+
+
+def register_product_set(store_id, product_ids):
+    """Room shared by every subscriber to the same products of a store"""
+    products = sorted(set(product_ids))
+    set_id = hashlib.sha1(','.join(map(str, products)).encode()).hexdigest()[:16]
+    key = SETS_KEY.format(store_id)
+    pipe = redis_client.pipeline()
+    pipe.hset(key, set_id, json.dumps(products))
+    pipe.expire(key, LIVE_SET_TTL)
+    pipe.execute()
+    return product_set_room(store_id, set_id)
+
+
+def queue_stock_changes(rows):
+    """Record committed quantities {(store_id, product_id): row}; the flusher sends them as diffs"""
+    if not rows:
+        return
+    pipe = redis_client.pipeline()
+    for (store_id, product_id), row in rows.items():
+        # Later writes overwrite earlier ones, so a frame only carries the latest quantity
+        pipe.hset(PENDING_KEY.format(store_id), product_id, row.quantity)
+    pipe.sadd(DIRTY_KEY, *{store_id for store_id, _ in rows})
+    pipe.execute()
+
+
+def claim_changes(max_stores=1000):
+    """Take the pending changes of up to max_stores dirty stores, returns {store_id: {product_id: quantity}}"""
+    claimed = {}
+    for store_id in redis_client.spop(DIRTY_KEY, max_stores) or []:
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.hgetall(PENDING_KEY.format(store_id))
+        pipe.delete(PENDING_KEY.format(store_id))
+        changes = pipe.execute()[0]
+        if changes:
+            claimed[int(store_id)] = {int(product_id): int(quantity) for product_id, quantity in changes.items()}
+    return claimed
+
+
+def requeue_changes(store_id, changes):
+    """Put back claimed changes whose emit failed; anything queued since is newer and wins"""
+    pipe = redis_client.pipeline()
+    for product_id, quantity in changes.items():
+        pipe.hsetnx(PENDING_KEY.format(store_id), product_id, quantity)
+    pipe.sadd(DIRTY_KEY, store_id)
+    pipe.execute()
+
+
+def flush_changes(socketio):
+    """Emit one stock_diff per store and product-set room, and one stock_update per product room"""
+    timestamp = datetime.utcnow().isoformat()
+    for store_id, changes in claim_changes().items():
+        try:
+            emit_store_changes(socketio, store_id, changes, timestamp)
+        except Exception:
+            # Frames carry latest quantities, so resending ones that did go out is harmless
+            logger.exception(f"Live update emit failed for store {store_id}, requeued")
+            requeue_changes(store_id, changes)
+
+
+def emit_store_changes(socketio, store_id, changes, timestamp):
+    socketio.emit('stock_diff', {
+        'store_id': store_id,
+        'changes': changes,
+        'timestamp': timestamp
+    }, to=store_room(store_id))
+    emitted = 1
+
+    for set_id, products in redis_client.hgetall(SETS_KEY.format(store_id)).items():
+        subset = {product_id: changes[product_id] for product_id in json.loads(products) if product_id in changes}
+        if subset:
+            socketio.emit('stock_diff', {
+                'store_id': store_id,
+                'changes': subset,
+                'timestamp': timestamp
+            }, to=product_set_room(store_id, set_id))
+            emitted += 1
+    count_emit('stock_diff', emitted)
+
+    for product_id, quantity in changes.items():
+        socketio.emit('stock_update', {
+            'product_id': product_id,
+            'quantity': quantity,
+            'store_id': store_id,
+            'timestamp': timestamp
+        }, to=product_room(store_id, product_id))
+    count_emit('stock_update', len(changes))
+
+
+def _flush_loop(socketio):
+    while True:
+        socketio.sleep(LIVE_UPDATE_INTERVAL)
+        try:
+            # Every web process runs a loop; the lock keeps it to one flush per interval overall
+            if redis_client.set(FLUSH_LOCK_KEY, os.getpid(), nx=True, px=max(1, int(LIVE_UPDATE_INTERVAL * 1000))):
+                flush_changes(socketio)
+        except Exception:
+            # Unclaimed changes stay in Redis for the next round
+            logger.exception("Live update flush failed")
+
+
+def ensure_flusher(socketio):
+    """Start the diff flusher once per web process; every instance drains the shared queue, subscribers or not"""
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        socketio.start_background_task(_flush_loop, socketio)
+        _flusher_pid = os.getpid()
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import pickle
+import logging
+import threading
+from collections import OrderedDict
+from app_factory import redis_client
+from metrics import count_cache, LOCAL_CACHE_BYTES, LOCAL_CACHE_EVICTIONS
+
+# Per-process budget for the in-memory tier; 0 turns it off and every lookup goes to Redis
+LOCAL_CACHE_MAX_BYTES = int(os.environ.get('LOCAL_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# Backstop for a lost invalidation; normally entries leave on the pub/sub message
+LOCAL_CACHE_TTL = float(os.environ.get('LOCAL_CACHE_TTL', 30))
+
+INVALIDATE_CHANNEL = 'cache:invalidate'
+
+logger = logging.getLogger(__name__)
+
+
+class LocalCache:
+    """Byte-bounded LRU with per-entry expiry, kept coherent by invalidations from Redis pub/sub"""
+
+    def __init__(self, name, max_bytes, ttl):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, size, expires_at)
+        self.size = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # Only serve from memory while subscribed, otherwise nothing would tell us to drop entries
+        self.listening = False
+        self._listener_pid = None
+
+    def after_fork(self):
+        """A forked worker gets its own lock and starts empty and unsubscribed"""
+        self.lock = threading.Lock()
+        self.listening = False
+        self._listener_pid = None
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        if not self.listening:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] <= time.monotonic():
+                self._drop(key, 'expired')
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        count_cache(self.name, 'hit' if entry is not None else 'miss')
+        return entry[0] if entry is not None else None
+
+    def set(self, key, value, generation, timeout=None):
+        """Store value unless an invalidation arrived since generation was read"""
+        if not self.listening:
+            return
+        # Approximates the in-memory footprint by the pickled size, as Redis stores it
+        size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + min(timeout or self.ttl, self.ttl)
+        with self.lock:
+            if generation != self.generation:
+                return
+            if key in self.entries:
+                self._drop(key, None)
+            self.entries[key] = (value, size, expires_at)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)), 'size')
+        LOCAL_CACHE_BYTES.labels(self.name).set(self.size)
+
+    def _drop(self, key, reason):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
+        if reason:
+            self.evictions += 1
+            LOCAL_CACHE_EVICTIONS.labels(self.name, reason).inc()
+
+    def invalidate(self, keys):
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                if key in self.entries:
+                    self._drop(key, 'invalidated')
+        LOCAL_CACHE_BYTES.labels(self.name).set(self.size)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.size = 0
+        LOCAL_CACHE_BYTES.labels(self.name).set(0)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.listening,
+            'entries': len(self.entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'evictions': self.evictions
+        }
+
+    def _listen(self):
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                pubsub.subscribe(INVALIDATE_CHANNEL)
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        # Anything published while we were not subscribed is lost, so start empty
+                        self.clear()
+                        self.listening = True
+                    elif message['type'] == 'message':
+                        self.invalidate(json.loads(message['data']))
+            except Exception:
+                logger.exception("Cache invalidation subscriber failed, retrying")
+            finally:
+                self.listening = False
+                self.clear()
+                pubsub.close()
+            time.sleep(1)
+
+    def ensure_listener(self):
+        """Subscribe to invalidations once per process; until then the tier stays off"""
+        if self.max_bytes <= 0 or self._listener_pid == os.getpid():
+            return
+        with self.lock:
+            if self._listener_pid == os.getpid():
+                return
+            # A forked worker must not serve the parent's entries
+            self.listening = False
+            self.entries.clear()
+            self.size = 0
+            from app_factory import socketio
+            socketio.start_background_task(self._listen)
+            self._listener_pid = os.getpid()
+
+
+def publish_invalidation(keys):
+    """Tell every process, this one included, to drop keys from its local tier"""
+    keys = list(keys)
+    if keys:
+        redis_client.publish(INVALIDATE_CHANNEL, json.dumps(keys))
+
+
+local_stock_cache = LocalCache('stock_local', LOCAL_CACHE_MAX_BYTES, LOCAL_CACHE_TTL)
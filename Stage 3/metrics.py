@@ -0,0 +1,202 @@
+import os
+import random
+import shutil
+import time
+import logging
+from contextlib import contextmanager
+from flask import Response, g, request, has_request_context, current_app
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, start_http_server
+)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Log the slowest statements' plans for requests over this many seconds; 0 disables the sampler
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 0))
+SLOW_REQUEST_SAMPLE_RATE = float(os.environ.get('SLOW_REQUEST_SAMPLE_RATE', 0.1))
+SLOW_REQUEST_MAX_PLANS = int(os.environ.get('SLOW_REQUEST_MAX_PLANS', 3))
+# Celery workers serve their own /metrics on this port when set
+CELERY_METRICS_PORT = int(os.environ.get('CELERY_METRICS_PORT', 0))
+
+REQUEST_SECONDS = Histogram(
+    'bazaar_http_request_duration_seconds', 'Request duration by route',
+    ['method', 'route', 'status']
+)
+REQUEST_SQL_STATEMENTS = Histogram(
+    'bazaar_http_request_sql_statements', 'SQL statements executed per request',
+    ['route'], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+)
+REQUEST_SQL_SECONDS = Histogram(
+    'bazaar_http_request_sql_seconds', 'Time spent in SQL per request', ['route']
+)
+STAGE_SECONDS = Histogram(
+    'bazaar_request_stage_seconds', 'Time spent in one part of a request (auth, cache, load)', ['stage']
+)
+CACHE_REQUESTS = Counter(
+    'bazaar_cache_requests_total', 'Cache lookups by outcome', ['cache', 'result']
+)
+TASK_QUEUE_WAIT_SECONDS = Histogram(
+    'bazaar_celery_task_queue_wait_seconds', 'Time between publish and a worker starting the task', ['task'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+)
+TASK_RUN_SECONDS = Histogram(
+    'bazaar_celery_task_run_seconds', 'Task run time', ['task', 'state']
+)
+SOCKET_EMITS = Counter(
+    'bazaar_socket_emits_total', 'Socket.IO events emitted', ['event']
+)
+LOCAL_CACHE_BYTES = Gauge(
+    'bazaar_local_cache_bytes', 'Bytes held by the in-process cache tier', ['cache'], multiprocess_mode='livesum'
+)
+LOCAL_CACHE_EVICTIONS = Counter(
+    'bazaar_local_cache_evictions_total', 'In-process cache entries dropped, by reason', ['cache', 'reason']
+)
+READ_ROUTES = Counter(
+    'bazaar_read_routing_total', 'Where reads were routed and why', ['reason']
+)
+
+
+def route_label():
+    # The URL rule, not the path, so /stock/1 and /stock/2 share a series
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+@contextmanager
+def timed(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+
+
+def count_cache(cache_name, result):
+    CACHE_REQUESTS.labels(cache_name, result).inc()
+
+
+def count_emit(event_name, count=1):
+    SOCKET_EMITS.labels(event_name).inc(count)
+
+
+def registry():
+    """The registry to export: aggregated across processes when PROMETHEUS_MULTIPROC_DIR is set"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        collector = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collector)
+        return collector
+    return REGISTRY
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['_metrics_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('_metrics_started', None)
+    if started is None:
+        return
+    if not has_request_context() or '_sql_count' not in g:
+        return
+    elapsed = time.perf_counter() - started
+    g._sql_count += 1
+    g._sql_seconds += elapsed
+    if g._sql_sampled is not None:
+        g._sql_sampled.append((elapsed, statement, parameters, conn.engine))
+
+
+def explain(engine, statement, parameters):
+    prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(prefix + statement, parameters or ()).all()
+    return '\n'.join(' '.join(str(column) for column in row) for row in rows)
+
+
+def log_slow_request(route, elapsed, statements):
+    """Plans for the slowest SELECTs of a slow request, run on the engine that executed them"""
+    lines = [f"Slow request {request.method} {route}: {elapsed:.3f}s, "
+             f"{g._sql_count} statements, {g._sql_seconds:.3f}s in SQL"]
+    slowest = sorted(statements, key=lambda s: s[0], reverse=True)
+    for statement_seconds, statement, parameters, engine in slowest[:SLOW_REQUEST_MAX_PLANS]:
+        lines.append(f"-- {statement_seconds:.3f}s: {statement}")
+        if not statement.lstrip().upper().startswith('SELECT'):
+            continue
+        try:
+            lines.append(explain(engine, statement, parameters))
+        except Exception as e:
+            lines.append(f"(no plan: {e})")
+    current_app.logger.warning('\n'.join(lines))
+
+
+def init_metrics(app):
+    """Per-request timing and SQL accounting, plus the /metrics endpoint"""
+
+    @app.before_request
+    def start_request_metrics():
+        g._request_started = time.perf_counter()
+        g._sql_count = 0
+        g._sql_seconds = 0.0
+        sample = SLOW_REQUEST_SECONDS > 0 and random.random() < SLOW_REQUEST_SAMPLE_RATE
+        g._sql_sampled = [] if sample else None
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop('_request_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = route_label()
+        REQUEST_SECONDS.labels(request.method, route, response.status_code).observe(elapsed)
+        REQUEST_SQL_STATEMENTS.labels(route).observe(g._sql_count)
+        REQUEST_SQL_SECONDS.labels(route).observe(g._sql_seconds)
+        if g._sql_sampled is not None and elapsed >= SLOW_REQUEST_SECONDS:
+            log_slow_request(route, elapsed, g._sql_sampled)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(generate_latest(registry()), mimetype=CONTENT_TYPE_LATEST)
+
+
+def task_published(headers):
+    # Wall clock, since the publisher and the worker are different processes
+    headers['published_at'] = time.time()
+
+
+def task_started(task):
+    task.request._metrics_started = time.perf_counter()
+    published_at = getattr(task.request, 'published_at', None)
+    # Retries are republished with fresh headers, so the wait is per attempt
+    if published_at is not None:
+        TASK_QUEUE_WAIT_SECONDS.labels(task.name).observe(max(0.0, time.time() - published_at))
+
+
+def task_finished(task, state):
+    started = getattr(task.request, '_metrics_started', None)
+    if started is not None:
+        TASK_RUN_SECONDS.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - started)
+
+
+def serve_worker_metrics():
+    """Serve the prefork children's metrics from the worker's main process, which runs no tasks itself"""
+    if not CELERY_METRICS_PORT:
+        return
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if not directory:
+        logger.error("CELERY_METRICS_PORT is set but PROMETHEUS_MULTIPROC_DIR is not; "
+                     "the task counters live in the pool processes, so not serving worker metrics")
+        return
+    # Files left by a previous run would be added to this one's totals; the pool isn't forked yet
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+    start_http_server(CELERY_METRICS_PORT, registry=registry())
+
+
+def worker_process_exited(pid):
+    """Drop an exited pool process's live gauges; its counters and histograms stay in the totals"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid)
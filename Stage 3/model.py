@@ -31,7 +31,7 @@ class ProductCatalog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
-    category = db.Column(db.String(50))
+    category = db.Column(db.String(50), index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class StoreInventory(db.Model):
@@ -42,9 +42,17 @@ class StoreInventory(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('product_catalog.id'), nullable=False)
     quantity = db.Column(db.Integer, default=0)
     last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Effective low-stock threshold copied from product_thresholds / category_thresholds,
+    # so the stock upsert returns it and crossings are checked without another query
+    reorder_point = db.Column(db.Integer)
     
     store = db.relationship('Store', backref='inventory')
     product = db.relationship('ProductCatalog', backref='inventory')
+    
+    # One row per (store, product) so deltas can be applied with INSERT ... ON CONFLICT
+    __table_args__ = (
+        db.UniqueConstraint('store_id', 'product_id', name='uq_store_inventory_store_product'),
+    )
 
 class AuditLog(db.Model):
     __tablename__ = 'audit_logs'
@@ -57,4 +65,71 @@ class AuditLog(db.Model):
     old_values = db.Column(db.JSON)
     new_values = db.Column(db.JSON)
     ip_address = db.Column(db.String(45))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Set by the audit buffer so redelivered entries are written once
+    event_id = db.Column(db.String(32), unique=True)
+    
+    # Keyset pagination walks (created_at, id) descending, optionally behind an equality filter
+    __table_args__ = (
+        db.Index('ix_audit_logs_created_id', 'created_at', 'id'),
+        db.Index('ix_audit_logs_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_audit_logs_action_created', 'action', 'created_at', 'id'),
+        db.Index('ix_audit_logs_record_type_created', 'record_type', 'created_at', 'id'),
+    )
+
+class InventoryRollup(db.Model):
+    __tablename__ = 'inventory_rollups'
+    
+    # One row per (dimension, key, day): dimension is store, product or location
+    dimension = db.Column(db.String(16), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    total_quantity = db.Column(db.BigInteger, nullable=False, default=0)
+    sku_count = db.Column(db.Integer, nullable=False, default=0)
+    stockout_count = db.Column(db.Integer, nullable=False, default=0)
+    refreshed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_inventory_rollups_dimension_day', 'dimension', 'day'),
+    )
+
+class ProductThreshold(db.Model):
+    __tablename__ = 'product_thresholds'
+    
+    # Overrides the category threshold for one product in one store
+    store_id = db.Column(db.Integer, db.ForeignKey('stores.id'), primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product_catalog.id'), primary_key=True)
+    threshold = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class CategoryThreshold(db.Model):
+    __tablename__ = 'category_thresholds'
+    
+    category = db.Column(db.String(50), primary_key=True)
+    threshold = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class StockAlert(db.Model):
+    __tablename__ = 'stock_alerts'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    store_id = db.Column(db.Integer, nullable=False)
+    product_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(16), nullable=False)  # low | recovered
+    threshold = db.Column(db.Integer, nullable=False)
+    previous_quantity = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_stock_alerts_created_id', 'created_at', 'id'),
+        db.Index('ix_stock_alerts_store_created', 'store_id', 'created_at', 'id'),
+    )
+
+class StockFlush(db.Model):
+    __tablename__ = 'stock_flushes'
+    
+    # One row per applied coalescing claim, written in the same transaction as its deltas
+    claim = db.Column(db.String(64), primary_key=True)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
@@ -0,0 +1,198 @@
+import os
+import re
+import time
+import bisect
+import hashlib
+import json
+import threading
+from collections import defaultdict
+from sqlalchemy import Integer, and_, case, cast, false, func, literal, literal_column, or_, select, text
+from app_factory import db
+from model import ProductCatalog
+
+PRODUCT_SEARCH_CACHE_TTL = int(os.environ.get('PRODUCT_SEARCH_CACHE_TTL', 300))
+# How often the SQLite fallback index checks whether the catalog changed
+PRODUCT_INDEX_CHECK = float(os.environ.get('PRODUCT_INDEX_CHECK', 5))
+
+# pg_trgm's defaults for the % and <% operators, mirrored by the in-memory index
+SIMILARITY_THRESHOLD = 0.3
+WORD_SIMILARITY_THRESHOLD = 0.6
+
+# rank = tier * 1000 + similarity in thousandths; an integer, so keyset cursors compare exactly
+TIERS = {3: 'prefix', 2: 'word', 1: 'fuzzy', 0: 'category'}
+
+# Must stay identical to the indexed expression below or Postgres won't use the index
+DOCUMENT_SQL = "to_tsvector('simple', product_catalog.name || ' ' || coalesce(product_catalog.description, ''))"
+
+SEARCH_INDEXES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_product_catalog_name_prefix ON product_catalog (lower(name) text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_product_catalog_name_trgm ON product_catalog USING gin (lower(name) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_product_catalog_document ON product_catalog USING gin "
+    "(to_tsvector('simple', name || ' ' || coalesce(description, '')))",
+    "CREATE INDEX IF NOT EXISTS ix_product_catalog_category ON product_catalog (category)"
+]
+
+_index = None
+_index_signature = None
+_index_checked_at = 0.0
+_index_lock = threading.Lock()
+
+
+def ensure_search_indexes():
+    """Trigram, prefix and full-text indexes for /products/search (Postgres only)"""
+    for statement in SEARCH_INDEXES:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+def words(value):
+    return re.findall(r'\w+', (value or '').lower())
+
+
+def search_cache_key(term, category, after, limit):
+    raw = json.dumps([term, category, after, limit])
+    return f"products:search:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+
+def search_products(session, term, category, after, limit):
+    """Up to limit products matching term (lowercased) and/or category, best first; after is a (rank, id) cursor"""
+    if session.get_bind().dialect.name == 'postgresql':
+        return postgres_search(session, term, category, after, limit)
+    return memory_index(session).search(term, category, after, limit)
+
+
+def postgres_search(session, term, category, after, limit):
+    name = func.lower(ProductCatalog.name)
+    if term:
+        prefix = name.like(term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%', escape='\\')
+        tokens = words(term)
+        # Every word must appear, the last one possibly still being typed
+        word = literal_column(DOCUMENT_SQL).op('@@')(
+            func.to_tsquery('simple', ' & '.join(f"{token}:*" for token in tokens))
+        ) if tokens else false()
+        fuzzy = or_(name.op('%')(term), literal(term).op('<%')(name))
+        similarity = func.greatest(func.similarity(name, term), func.word_similarity(term, name))
+        rank = case((prefix, 3), (word, 2), else_=1) * 1000 + cast(func.floor(similarity * 999), Integer)
+        criteria = [or_(prefix, word, fuzzy)]
+    else:
+        rank = literal(0)
+        criteria = []
+    if category:
+        criteria.append(ProductCatalog.category == category)
+
+    ranked = select(
+        ProductCatalog.id, ProductCatalog.name, ProductCatalog.description, ProductCatalog.category,
+        rank.label('rank')
+    ).where(*criteria).subquery('ranked')
+    query = select(ranked)
+    if after:
+        query = query.where(or_(ranked.c.rank < after[0], and_(ranked.c.rank == after[0], ranked.c.id > after[1])))
+    rows = session.execute(query.order_by(ranked.c.rank.desc(), ranked.c.id).limit(limit))
+    return [dict(row._mapping) for row in rows]
+
+
+def trigrams(value):
+    """pg_trgm-style trigrams: each word padded with two spaces in front and one behind"""
+    grams = set()
+    for word in words(value):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+class ProductIndex:
+    """In-memory stand-in for the Postgres indexes, for SQLite runs; same tiers and ranks, approximately"""
+
+    def __init__(self, products):
+        self.products = {product['id']: product for product in products}
+        self.names = sorted((product['name'].lower(), product['id']) for product in products)
+        self.token_ids = defaultdict(set)
+        self.gram_ids = defaultdict(set)
+        self.name_grams = {}
+        self.word_grams = {}
+        for product in products:
+            for token in words(f"{product['name']} {product['description'] or ''}"):
+                self.token_ids[token].add(product['id'])
+            self.name_grams[product['id']] = trigrams(product['name'])
+            self.word_grams[product['id']] = [trigrams(word) for word in words(product['name'])]
+            for gram in self.name_grams[product['id']]:
+                self.gram_ids[gram].add(product['id'])
+        self.tokens = sorted(self.token_ids)
+
+    def prefix_ids(self, term):
+        ids = set()
+        for name, product_id in self.names[bisect.bisect_left(self.names, (term,)):]:
+            if not name.startswith(term):
+                break
+            ids.add(product_id)
+        return ids
+
+    def word_ids(self, tokens):
+        """Products containing every token as a word prefix, like 'a:* & b:*'"""
+        matched = None
+        for token in tokens:
+            ids = set()
+            for indexed in self.tokens[bisect.bisect_left(self.tokens, token):]:
+                if not indexed.startswith(token):
+                    break
+                ids |= self.token_ids[indexed]
+            matched = ids if matched is None else matched & ids
+        return matched or set()
+
+    def score(self, product_id, grams):
+        # Best of whole-name and per-word similarity, close to greatest(similarity, word_similarity)
+        whole = similarity(grams, self.name_grams[product_id])
+        best_word = max((similarity(grams, word) for word in self.word_grams[product_id]), default=0.0)
+        return whole, max(whole, best_word)
+
+    def search(self, term, category, after, limit):
+        ranked = []
+        if term:
+            prefix, word, grams = self.prefix_ids(term), self.word_ids(words(term)), trigrams(term)
+            candidates = prefix | word | set().union(*(self.gram_ids[gram] for gram in grams))
+            for product_id in candidates:
+                whole, best = self.score(product_id, grams)
+                if product_id in prefix:
+                    tier = 3
+                elif product_id in word:
+                    tier = 2
+                elif whole >= SIMILARITY_THRESHOLD or best >= WORD_SIMILARITY_THRESHOLD:
+                    tier = 1
+                else:
+                    continue
+                ranked.append((tier * 1000 + int(best * 999), product_id))
+        else:
+            ranked = [(0, product_id) for product_id in self.products]
+
+        if category:
+            ranked = [(rank, product_id) for rank, product_id in ranked
+                      if self.products[product_id]['category'] == category]
+        if after:
+            ranked = [(rank, product_id) for rank, product_id in ranked
+                      if rank < after[0] or (rank == after[0] and product_id > after[1])]
+        ranked.sort(key=lambda item: (-item[0], item[1]))
+        return [{**self.products[product_id], 'rank': rank} for rank, product_id in ranked[:limit]]
+
+
+def memory_index(session):
+    """Per-process index, rebuilt when the catalog's row count or highest id moves"""
+    global _index, _index_signature, _index_checked_at
+    if _index is not None and time.time() - _index_checked_at < PRODUCT_INDEX_CHECK:
+        return _index
+    with _index_lock:
+        signature = tuple(session.execute(
+            select(func.count(ProductCatalog.id), func.max(ProductCatalog.id))
+        ).one())
+        if _index is None or signature != _index_signature:
+            rows = session.execute(select(
+                ProductCatalog.id, ProductCatalog.name, ProductCatalog.description, ProductCatalog.category
+            ))
+            _index = ProductIndex([dict(row._mapping) for row in rows])
+            _index_signature = signature
+        _index_checked_at = time.time()
+        return _index
@@ -0,0 +1,119 @@
+import os
+from collections import Counter
+from flask import g
+from sqlalchemy import text
+from app_factory import db, redis_client
+from replica_pool import ReplicaPool
+from metrics import READ_ROUTES
+
+# How long a client's reads stick to the master after a write, unless the replica catches up first
+READ_YOUR_WRITES_WINDOW = int(os.environ.get('READ_YOUR_WRITES_WINDOW', 10))
+
+PENDING = 'pending'
+
+# Per-process counts of where reads went and why, also exported on /metrics
+routing_stats = Counter()
+
+
+def count_route(reason):
+    routing_stats[reason] += 1
+    READ_ROUTES.labels(reason).inc()
+
+
+def init_read_sessions(app):
+    """One replica pool per app; each replica keeps its own engine and session factory"""
+    engine_options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    app.extensions['replica_pool'] = ReplicaPool(app.config['REPLICA_URIS'], engine_options)
+
+    @app.teardown_appcontext
+    def close_replica_session(exc):
+        session = g.pop('_replica_session', None)
+        if session is not None:
+            session.close()
+
+
+def replica_pool():
+    from flask import current_app
+    return current_app.extensions['replica_pool']
+
+
+def current_replica():
+    """The replica chosen for this request, None when no replica qualifies"""
+    if '_replica' not in g:
+        g._replica = replica_pool().choose()
+    return g._replica
+
+
+def replica_session():
+    if '_replica_session' not in g:
+        g._replica_session = current_replica().session_factory()
+    return g._replica_session
+
+
+def report_replica_failure(error):
+    """A read on this request's replica failed: eject it so the next requests skip it"""
+    replica = g.get('_replica')
+    if replica is not None:
+        replica.record_failure(error)
+
+
+def ryw_key(client):
+    return f"ryw:{client}"
+
+
+def mark_pending_write(client):
+    """Called when a write is queued: the commit hasn't happened yet, so read from the master"""
+    if client:
+        redis_client.set(ryw_key(client), PENDING, ex=READ_YOUR_WRITES_WINDOW)
+
+
+def mark_committed_write(client):
+    """Called after commit: remember the master's WAL position so reads can return to the replica once it replays it"""
+    mark_committed_writes([client])
+
+
+def mark_committed_writes(clients):
+    """mark_committed_write for every client of one commit, with a single WAL position lookup"""
+    clients = [client for client in clients if client]
+    if not clients:
+        return
+    lsn = PENDING
+    if db.engine.dialect.name == 'postgresql':
+        lsn = db.session.execute(text("SELECT pg_current_wal_lsn()::text")).scalar()
+    pipe = redis_client.pipeline()
+    for client in clients:
+        pipe.set(ryw_key(client), lsn, ex=READ_YOUR_WRITES_WINDOW)
+    pipe.execute()
+
+
+def replica_has_caught_up(lsn):
+    # A replica URI that points at a primary is trivially caught up
+    return replica_session().execute(text(
+        "SELECT CASE WHEN pg_is_in_recovery() "
+        "THEN pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn) ELSE true END"
+    ), {'lsn': lsn}).scalar()
+
+
+def read_session(client):
+    """Pick the session for a client's read, returns (session, from_master)"""
+    marker = redis_client.get(ryw_key(client)) if client else None
+
+    if current_replica() is None:
+        reason = 'master_no_replica'
+    elif marker is None:
+        reason = 'replica'
+    elif marker == PENDING:
+        reason = 'master_pending_write'
+    else:
+        try:
+            reason = 'replica_caught_up' if replica_has_caught_up(marker) else 'master_replica_lagging'
+        except Exception as e:
+            replica_session().rollback()
+            report_replica_failure(e)
+            reason = 'master_replica_error'
+
+    count_route(reason)
+    if reason.startswith('master'):
+        return db.session, True
+    count_route(f"replica:{current_replica().name}")
+    return replica_session(), False
@@ -0,0 +1,132 @@
+import os
+import random
+import threading
+import time
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5))
+REPLICA_PROBE_INTERVAL = float(os.environ.get('REPLICA_PROBE_INTERVAL', 2))
+REPLICA_EJECT_BASE = float(os.environ.get('REPLICA_EJECT_BASE', 2))
+REPLICA_EJECT_MAX = float(os.environ.get('REPLICA_EJECT_MAX', 60))
+
+# Seconds behind the master; 0 when everything received has been replayed or the node isn't a standby
+LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+class Replica:
+    def __init__(self, name, uri, engine_options):
+        self.name = name
+        # Pool sizing only applies to server databases
+        self.engine = create_engine(uri, **(engine_options if uri.startswith('postgresql') else {}))
+        self.session_factory = sessionmaker(bind=self.engine)
+        self.lag = None
+        self.failures = 0
+        self.ejected_until = 0
+        self.last_error = None
+        self.last_probe = None
+
+    def available(self, now=None):
+        return (now or time.time()) >= self.ejected_until
+
+    def qualifies(self, max_lag):
+        return self.available() and self.lag is not None and self.lag <= max_lag
+
+    def record_failure(self, error):
+        # Exponential backoff: 2s, 4s, 8s ... capped
+        self.failures += 1
+        self.last_error = str(error)
+        self.lag = None
+        self.ejected_until = time.time() + min(REPLICA_EJECT_BASE * 2 ** (self.failures - 1), REPLICA_EJECT_MAX)
+
+    def probe(self):
+        try:
+            with self.engine.connect() as conn:
+                if self.engine.dialect.name == 'postgresql':
+                    self.lag = float(conn.execute(text(LAG_QUERY)).scalar())
+                else:
+                    conn.execute(text("SELECT 1"))
+                    self.lag = 0.0
+            self.failures = 0
+            self.ejected_until = 0
+            self.last_error = None
+        except Exception as e:
+            self.record_failure(e)
+        self.last_probe = time.time()
+
+    def status(self):
+        now = time.time()
+        return {
+            "name": self.name,
+            "healthy": self.qualifies(REPLICA_MAX_LAG),
+            "lag_seconds": self.lag,
+            "failures": self.failures,
+            "ejected_for": round(self.ejected_until - now, 1) if not self.available(now) else 0,
+            "last_error": self.last_error,
+            "last_probe": self.last_probe
+        }
+
+
+class ReplicaPool:
+    """Read replicas probed in the background and picked by lag"""
+
+    def __init__(self, uris, engine_options=None, max_lag=REPLICA_MAX_LAG):
+        self.max_lag = max_lag
+        self.replicas = []
+        for uri in uris:
+            url = make_url(uri)
+            name = f"{url.host or 'local'}:{url.port or ''}/{url.database or ''}"
+            self.replicas.append(Replica(name, uri, engine_options or {}))
+        self._probe_pid = None
+        self._lock = threading.Lock()
+
+    def after_fork(self):
+        """Fresh pools and lock in a forked child; the prober restarts on first use"""
+        self._lock = threading.Lock()
+        self._probe_pid = None
+        for replica in self.replicas:
+            replica.engine.dispose(close=False)
+
+    def probe_all(self):
+        now = time.time()
+        for replica in self.replicas:
+            # Ejected replicas are left alone until their backoff runs out
+            if replica.available(now):
+                replica.probe()
+
+    def _probe_loop(self):
+        while True:
+            self.probe_all()
+            time.sleep(REPLICA_PROBE_INTERVAL)
+
+    def ensure_prober(self):
+        """Start the probe thread lazily so each forked worker gets its own"""
+        if self._probe_pid == os.getpid():
+            return
+        with self._lock:
+            if self._probe_pid == os.getpid():
+                return
+            self.probe_all()
+            threading.Thread(target=self._probe_loop, name='replica-prober', daemon=True).start()
+            self._probe_pid = os.getpid()
+
+    def choose(self):
+        """Pick a replica within max lag (better of two random picks), or None to read from the master"""
+        self.ensure_prober()
+        candidates = [r for r in self.replicas if r.qualifies(self.max_lag)]
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        return first if first.lag <= second.lag else second
+
+    def status(self):
+        return [replica.status() for replica in self.replicas]
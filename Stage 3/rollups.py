@@ -0,0 +1,55 @@
+from datetime import datetime
+from sqlalchemy import cast, case, func, literal, select, true, String
+from app_factory import db
+from model import InventoryRollup, StoreInventory, Store
+
+DIMENSIONS = ('store', 'product', 'location')
+
+
+def rollup_source(dimension, day, now):
+    """Aggregate store_inventory for one dimension into rows shaped like inventory_rollups"""
+    if dimension == 'store':
+        key = cast(StoreInventory.store_id, String)
+    elif dimension == 'product':
+        key = cast(StoreInventory.product_id, String)
+    else:
+        key = Store.location
+
+    query = select(
+        literal(dimension),
+        key,
+        literal(day),
+        func.coalesce(func.sum(StoreInventory.quantity), 0),
+        func.count(),
+        func.sum(case((StoreInventory.quantity <= 0, 1), else_=0)),
+        literal(now)
+    )
+    if dimension == 'location':
+        query = query.select_from(StoreInventory).join(Store, Store.id == StoreInventory.store_id)
+    # SQLite needs an explicit WHERE to parse INSERT ... SELECT ... ON CONFLICT
+    return query.where(true()).group_by(key)
+
+
+def refresh_rollups(day=None):
+    """Upsert today's totals for every dimension in set-based statements, returns rows written"""
+    from async_task import dialect_insert
+
+    now = datetime.utcnow()
+    day = day or now.date()
+    columns = ['dimension', 'key', 'day', 'total_quantity', 'sku_count', 'stockout_count', 'refreshed_at']
+
+    written = 0
+    for dimension in DIMENSIONS:
+        stmt = dialect_insert(InventoryRollup).from_select(columns, rollup_source(dimension, day, now))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['dimension', 'key', 'day'],
+            set_={
+                'total_quantity': stmt.excluded.total_quantity,
+                'sku_count': stmt.excluded.sku_count,
+                'stockout_count': stmt.excluded.stockout_count,
+                'refreshed_at': stmt.excluded.refreshed_at
+            }
+        )
+        written += db.session.execute(stmt).rowcount
+    db.session.commit()
+    return written
@@ -1,21 +1,68 @@
-from sqlalchemy.orm import scoped_session, sessionmaker
 from flask import Blueprint, request, jsonify, current_app, g
-from flask_socketio import join_room
-from app_factory import db, cache, auth, socketio
-from model import User, AuditLog, StoreInventory
-from async_task import async_stock_update
+from flask_socketio import join_room, leave_room
+from app_factory import db, cache, auth, basic_auth, token_auth, socketio
+from model import User, AuditLog, StoreInventory, InventoryRollup, StockAlert
+from async_task import celery, async_stock_update, async_stock_batch_update, flush_stock_buffer, known_inventory_keys
+from coalesce import COALESCE_ENABLED, WINDOW, buffer_stock_delta
+from audit_buffer import enqueue_audit
+from stock_cache import get_store_stock
+from local_cache import local_stock_cache
+from live_updates import (LIVE_MAX_PRODUCT_SET, ensure_flusher, product_room, store_room,
+                          register_product_set)
+from rollups import DIMENSIONS
+from inventory_import import MODES, FORMATS, import_inventory
+from product_search import TIERS, PRODUCT_SEARCH_CACHE_TTL, search_cache_key, search_products
+from alerts import ALERTS_ROOM, store_alerts_room, set_product_threshold, set_category_threshold
+from read_routing import (read_session, mark_pending_write, report_replica_failure, replica_pool, routing_stats,
+                          count_route, current_replica, replica_session)
+from metrics import timed, count_emit, count_cache
+from green import offload
 from functools import wraps
+from collections import namedtuple
+from datetime import datetime
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from sqlalchemy import text
+import base64
+import json
+import os
+import time
+import uuid
 
 api_bp = Blueprint('api', __name__)
 
-@auth.verify_password
+STOCK_BATCH_MAX = int(os.environ.get('STOCK_BATCH_MAX', 5000))
+API_TOKEN_TTL = int(os.environ.get('API_TOKEN_TTL', 900))
+
+# What a verified bearer token tells us about the caller, no DB row needed
+TokenUser = namedtuple('TokenUser', ['id', 'username', 'is_admin'])
+
+def token_serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='api-token')
+
+@basic_auth.verify_password
 def verify_password(username, password):
-    user = User.query.filter_by(username=username).first()
-    if user and user.check_password(password):
+    with timed('auth_user_lookup'):
+        user = User.query.filter_by(username=username).first()
+    if user is None:
+        return None
+    with timed('auth_password_hash'):
+        valid = offload(user.check_password, password)
+    if valid:
         g.current_user = user
         return username
     return None
 
+@token_auth.verify_token
+def verify_token(token):
+    # Signature and age check only: no User query and no password KDF
+    try:
+        with timed('auth_token'):
+            data = token_serializer().loads(token, max_age=API_TOKEN_TTL)
+    except (BadSignature, SignatureExpired):
+        return None
+    g.current_user = TokenUser(data['id'], data['username'], data['is_admin'])
+    return data['username']
+
 
 def validate_json(*required_fields):
     def decorator(f):
@@ -36,21 +83,69 @@ def validate_json(*required_fields):
         return decorated_function
     return decorator
 
-# WebSocket handlers
+# WebSocket handlers; replies go to the calling session only
+def reply(event, data):
+    socketio.emit(event, data, to=request.sid)
+    count_emit(event)
+
 @socketio.on('connect')
 def handle_connect():
-    socketio.emit('ack', {'status': 'connected'})
+    ensure_flusher(socketio)
+    reply('ack', {'status': 'connected'})
 
 @socketio.on('subscribe_stock')
 def handle_subscribe(data):
     if 'store_id' in data and 'product_id' in data:
-        join_room(f"stock_{data['store_id']}_{data['product_id']}")
-        socketio.emit('subscribed', {
+        room = product_room(data['store_id'], data['product_id'])
+        join_room(room)
+        reply('subscribed', {
             'store_id': data['store_id'],
-            'product_id': data['product_id']
+            'product_id': data['product_id'],
+            'room': room
         })
     else:
-        socketio.emit('error', {'message': 'Missing store_id or product_id'})
+        reply('error', {'message': 'Missing store_id or product_id'})
+
+@socketio.on('subscribe_store')
+def handle_subscribe_store(data):
+    """Every product of a store, as stock_diff frames"""
+    if 'store_id' not in data:
+        return reply('error', {'message': 'Missing store_id'})
+    room = store_room(data['store_id'])
+    join_room(room)
+    reply('subscribed', {'store_id': data['store_id'], 'room': room})
+
+@socketio.on('subscribe_products')
+def handle_subscribe_products(data):
+    """A set of a store's products in one message, as stock_diff frames filtered to the set"""
+    product_ids = data.get('product_ids')
+    if 'store_id' not in data or not isinstance(product_ids, list) or not product_ids:
+        return reply('error', {'message': 'Missing store_id or product_ids'})
+    if len(product_ids) > LIVE_MAX_PRODUCT_SET:
+        return reply('error', {'message': f"At most {LIVE_MAX_PRODUCT_SET} products per subscription, "
+                                          f"subscribe to the store instead"})
+    try:
+        product_ids = [int(product_id) for product_id in product_ids]
+    except (TypeError, ValueError):
+        return reply('error', {'message': 'product_ids must be integers'})
+    room = register_product_set(data['store_id'], product_ids)
+    join_room(room)
+    reply('subscribed', {'store_id': data['store_id'], 'products': len(set(product_ids)), 'room': room})
+
+@socketio.on('subscribe_alerts')
+def handle_subscribe_alerts(data):
+    """Low-stock and recovered alerts, for one store or (without store_id) all of them"""
+    store_id = (data or {}).get('store_id')
+    room = store_alerts_room(store_id) if store_id is not None else ALERTS_ROOM
+    join_room(room)
+    reply('subscribed', {'store_id': store_id, 'room': room})
+
+@socketio.on('unsubscribe')
+def handle_unsubscribe(data):
+    if 'room' not in data:
+        return reply('error', {'message': 'Missing room'})
+    leave_room(data['room'])
+    reply('unsubscribed', {'room': data['room']})
 
 
 
@@ -64,7 +159,7 @@ def register_user():
             return jsonify({"error": "Username already exists"}), 409
             
         new_user = User(username=data['username'])
-        new_user.set_password(data['password'])
+        offload(new_user.set_password, data['password'])
         
         if 'is_admin' in data:
             new_user.is_admin = bool(data['is_admin'])
@@ -72,15 +167,13 @@ def register_user():
         db.session.add(new_user)
         db.session.commit()
         
-        audit_log = AuditLog(
+        enqueue_audit(
             user_id=new_user.username,
             action="USER_REGISTER",
             record_type="USER",
             record_id=new_user.id,
             new_values={"username": new_user.username, "is_admin": new_user.is_admin}
         )
-        db.session.add(audit_log)
-        db.session.commit()
         
         return jsonify({
             "status": "success",
@@ -96,6 +189,24 @@ def register_user():
 
 
 
+@api_bp.route('/token', methods=['POST'])
+@basic_auth.login_required
+def issue_token():
+    """Exchange Basic credentials for a short-lived bearer token"""
+    user = g.current_user
+    token = token_serializer().dumps({
+        "id": user.id,
+        "username": user.username,
+        "is_admin": bool(user.is_admin)
+    })
+    return jsonify({
+        "token": token,
+        "token_type": "Bearer",
+        "expires_in": API_TOKEN_TTL
+    })
+
+
+
 # EVENT DRIVEN ASYNC ACTION WITH CACHING
 @api_bp.route('/stock', methods=['POST'])
 @auth.login_required
@@ -113,6 +224,19 @@ def update_stock():
     except (ValueError, TypeError):
         return jsonify({"error": "Invalid data types"}), 400
     
+    mark_pending_write(user_id)
+    
+    if COALESCE_ENABLED:
+        window, is_new_window = buffer_stock_delta(store_id, product_id, quantity_change, user_id)
+        if is_new_window:
+            # First write of the window schedules its flush for just after it closes
+            flush_stock_buffer.apply_async(countdown=(window + 1) * WINDOW - time.time() + 0.1)
+        return jsonify({
+            "status": "buffered",
+            "message": "Update will be applied when the window closes",
+            "window": window
+        }), 202
+    
     task = async_stock_update.delay(
         store_id=store_id,
         product_id=product_id,
@@ -128,52 +252,211 @@ def update_stock():
 
 
 
-@api_bp.route('/stock/<int:store_id>', methods=['GET'])
-@cache.cached(timeout=30, query_string=True)
+@api_bp.route('/stock/batch', methods=['POST'])
 @auth.login_required
-def get_stock(store_id):
-    try:
-        replica_engine = db.get_engine(current_app, bind='replica')
-        Session = scoped_session(sessionmaker(bind=replica_engine))
-        session = Session()
-        
+@validate_json('updates')
+def update_stock_batch():
+    """Queue many stock deltas as one task"""
+    data = request.get_json()
+    updates = data['updates']
+    
+    if not isinstance(updates, list) or not updates:
+        return jsonify({"error": "updates must be a non-empty list"}), 400
+    if len(updates) > STOCK_BATCH_MAX:
+        return jsonify({"error": f"Batch exceeds {STOCK_BATCH_MAX} updates"}), 413
+    
+    user_id = g.current_user.username if hasattr(g, 'current_user') else "system"
+    
+    cleaned, errors = [], []
+    for index, item in enumerate(updates):
         try:
-            stock = session.query(StoreInventory).filter_by(store_id=store_id).all()
-            
-            result = [{
-                "product_id": item.product_id,
-                "quantity": item.quantity,
-                "last_updated": item.last_updated.isoformat()
-            } for item in stock]
-            
-            return jsonify(result)
-        finally:
-            session.remove()  
-            
+            cleaned.append({
+                'store_id': int(item['store_id']),
+                'product_id': int(item['product_id']),
+                'quantity': int(item['quantity'])
+            })
+        except (KeyError, ValueError, TypeError):
+            errors.append({"index": index, "error": "Missing or invalid store_id, product_id or quantity"})
+    
+    if errors:
+        return jsonify({"error": "Invalid updates", "items": errors}), 400
+    
+    mark_pending_write(user_id)
+    # Owner is stored before the task exists, so a fast poll never sees a result without one
+    task_id = uuid.uuid4().hex
+    cache.set(batch_owner_key(task_id), user_id, timeout=celery.conf.result_expires)
+    task = async_stock_batch_update.apply_async(kwargs={'updates': cleaned, 'user_id': user_id}, task_id=task_id)
+    
+    return jsonify({
+        "status": "queued",
+        "message": "Batch processing started",
+        "task_id": task.id,
+        "count": len(cleaned)
+    }), 202
+
+def batch_owner_key(task_id):
+    return f"stock:batch:{task_id}:owner"
+
+@api_bp.route('/stock/batch/<task_id>', methods=['GET'])
+@auth.login_required
+def get_stock_batch(task_id):
+    # Only the submitter (or an admin) may read a batch; anything else looks like an unknown task
+    owner = cache.get(batch_owner_key(task_id))
+    if owner is None or (owner != g.current_user.username and not g.current_user.is_admin):
+        return jsonify({"error": "Batch not found", "task_id": task_id}), 404
+    
+    result = celery.AsyncResult(task_id)
+    if not result.ready():
+        return jsonify({"status": result.status.lower(), "task_id": task_id}), 202
+    if result.failed():
+        return jsonify({"status": "failed", "task_id": task_id}), 500
+    
+    return jsonify({"status": "done", "task_id": task_id, **result.result})
+
+
+
+def load_store_stock(store_id, session):
+    try:
+        stock = session.query(StoreInventory).filter_by(store_id=store_id).all()
     except Exception as e:
-        current_app.logger.error(f"Error fetching stock: {str(e)}")
+        if session is db.session:
+            raise
+        current_app.logger.warning(f"Replica read failed, using master: {e}")
+        session.rollback()
+        report_replica_failure(e)
+        count_route('master_fallback')
         stock = StoreInventory.query.filter_by(store_id=store_id).all()
-        return jsonify([{
-            "product_id": item.product_id,
-            "quantity": item.quantity,
-            "last_updated": item.last_updated.isoformat()
-        } for item in stock])
+    
+    return [{
+        "product_id": item.product_id,
+        "quantity": item.quantity,
+        "last_updated": item.last_updated.isoformat()
+    } for item in stock]
+
+def timed_load(store_id, session):
+    with timed('stock_load'):
+        return load_store_stock(store_id, session)
+
+@api_bp.route('/stock/<int:store_id>', methods=['GET'])
+@auth.login_required
+def get_stock(store_id):
+    session, from_master = read_session(auth.current_user())
+    if from_master:
+        # The client just wrote; the shared cache may still hold the pre-write list
+        stock = timed_load(store_id, session)
+    else:
+        # Auth runs before the cache lookup; the entry is evicted when the store's stock changes
+        with timed('stock_cache'):
+            stock = get_store_stock(store_id, lambda: timed_load(store_id, session))
+    
+    with timed('stock_serialize'):
+        return jsonify(stock)
+
+@api_bp.route('/reports/summary', methods=['GET'])
+@auth.login_required
+def get_report_summary():
+    """Store, product or location totals per day, read from inventory_rollups"""
+    group_by = request.args.get('group_by', 'store')
+    if group_by not in DIMENSIONS:
+        return jsonify({"error": f"group_by must be one of {', '.join(DIMENSIONS)}"}), 400
+    
+    query = InventoryRollup.query.filter(InventoryRollup.dimension == group_by)
+    try:
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        if start_date:
+            query = query.filter(InventoryRollup.day >= datetime.fromisoformat(start_date).date())
+        if end_date:
+            query = query.filter(InventoryRollup.day <= datetime.fromisoformat(end_date).date())
+    except ValueError:
+        return jsonify({"error": "start_date and end_date must be ISO dates"}), 400
+    
+    if not start_date and not end_date:
+        # Default to the latest refreshed day
+        latest = db.session.query(db.func.max(InventoryRollup.day)).filter(InventoryRollup.dimension == group_by).scalar()
+        query = query.filter(InventoryRollup.day == latest)
+    
+    key = request.args.get('key')
+    if key:
+        query = query.filter(InventoryRollup.key == key)
+    
+    rows = query.order_by(InventoryRollup.day, InventoryRollup.key).all()
+    return jsonify({
+        "group_by": group_by,
+        "rows": [{
+            "key": row.key,
+            "day": row.day.isoformat(),
+            "total_quantity": row.total_quantity,
+            "sku_count": row.sku_count,
+            "stockout_count": row.stockout_count,
+            "refreshed_at": row.refreshed_at.isoformat()
+        } for row in rows]
+    })
+
+def encode_cursor(*values):
+    """Opaque keyset cursor from the last row's sort key"""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+
+def estimate_row_count(table_name):
+    """Planner estimate from pg_class, avoids a full COUNT(*); summed over the partitions of a partitioned table"""
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    # A partitioned parent's own reltuples is 0 or -1, and -1 also means "never analyzed"
+    partitions, total = db.session.execute(text(
+        "SELECT count(*), coalesce(sum(greatest(c.reltuples, 0)), 0)::bigint "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(:name)"
+    ), {"name": table_name}).one()
+    if partitions:
+        return total
+    return db.session.execute(
+        text("SELECT greatest(reltuples, 0)::bigint FROM pg_class WHERE relname = :name"), {"name": table_name}
+    ).scalar()
 
 @api_bp.route('/audit/logs', methods=['GET'])
 @auth.login_required
 def get_audit_logs():
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 100, type=int), 100)  
+        per_page = max(min(request.args.get('per_page', 100, type=int), 100), 1)
+        cursor = request.args.get('cursor')
+        count_mode = request.args.get('count')  # exact | estimate
         
-        logs = AuditLog.query.order_by(
-            AuditLog.created_at.desc()
-        ).paginate(page=page, per_page=per_page)
+        query = AuditLog.query
+        for field in ('user_id', 'action', 'record_type'):
+            value = request.args.get(field)
+            if value:
+                query = query.filter(getattr(AuditLog, field) == value)
         
-        return jsonify({
-            "total": logs.total,
-            "pages": logs.pages,
-            "current_page": page,
+        try:
+            start = request.args.get('start')
+            end = request.args.get('end')
+            if start:
+                query = query.filter(AuditLog.created_at >= datetime.fromisoformat(start))
+            if end:
+                query = query.filter(AuditLog.created_at < datetime.fromisoformat(end))
+        except ValueError:
+            return jsonify({"error": "start and end must be ISO datetimes"}), 400
+        
+        filtered = query
+        if cursor:
+            try:
+                cursor_ts, cursor_id = decode_cursor(cursor)
+                cursor_ts = datetime.fromisoformat(cursor_ts)
+            except (ValueError, TypeError):
+                return jsonify({"error": "Invalid cursor"}), 400
+            query = query.filter(db.tuple_(AuditLog.created_at, AuditLog.id) < db.tuple_(cursor_ts, cursor_id))
+        
+        # One extra row tells us whether there is a next page without counting
+        logs = query.order_by(AuditLog.created_at.desc(), AuditLog.id.desc()).limit(per_page + 1).all()
+        has_more = len(logs) > per_page
+        logs = logs[:per_page]
+        
+        response = {
+            "next_cursor": encode_cursor(logs[-1].created_at, logs[-1].id) if has_more else None,
             "logs": [{
                 "id": log.id,
                 "user_id": log.user_id,
@@ -183,34 +466,261 @@ def get_audit_logs():
                 "timestamp": log.created_at.isoformat(),
                 "old_values": log.old_values,
                 "new_values": log.new_values
-            } for log in logs.items]
-        })
+            } for log in logs]
+        }
+        if count_mode == 'exact':
+            response["total"] = filtered.order_by(None).count()
+        elif count_mode == 'estimate':
+            # Table-level estimate, only meaningful without filters
+            unfiltered = not any(request.args.get(f) for f in ('user_id', 'action', 'record_type', 'start', 'end'))
+            response["total_estimate"] = estimate_row_count(AuditLog.__tablename__) if unfiltered else None
+        
+        return jsonify(response)
     except Exception as e:
         current_app.logger.error(f"Error fetching audit logs: {e}")
         return jsonify({"error": "Failed to fetch audit logs"}), 500
 
+
+def parse_threshold(data):
+    """None removes the threshold; anything else must be a non-negative integer"""
+    threshold = data['threshold']
+    if threshold is None:
+        return None
+    threshold = int(threshold)
+    if threshold < 0:
+        raise ValueError("threshold must be >= 0")
+    return threshold
+
+@api_bp.route('/thresholds/product', methods=['PUT'])
+@auth.login_required
+@validate_json('store_id', 'product_id', 'threshold')
+def put_product_threshold():
+    if not g.current_user.is_admin:
+        return jsonify({"error": "Admin only"}), 403
+    data = request.get_json()
+    try:
+        store_id, product_id = int(data['store_id']), int(data['product_id'])
+        threshold = parse_threshold(data)
+    except (TypeError, ValueError):
+        return jsonify({"error": "store_id and product_id must be integers, threshold a non-negative integer or null"}), 400
+    if not known_inventory_keys({(store_id, product_id)}):
+        return jsonify({"error": "Unknown store or product"}), 404
+    
+    updated = set_product_threshold(store_id, product_id, threshold)
+    db.session.commit()
+    return jsonify({"store_id": store_id, "product_id": product_id, "threshold": threshold, "inventory_rows": updated})
+
+@api_bp.route('/thresholds/category', methods=['PUT'])
+@auth.login_required
+@validate_json('category', 'threshold')
+def put_category_threshold():
+    if not g.current_user.is_admin:
+        return jsonify({"error": "Admin only"}), 403
+    data = request.get_json()
+    try:
+        threshold = parse_threshold(data)
+    except (TypeError, ValueError):
+        return jsonify({"error": "threshold must be a non-negative integer or null"}), 400
+    
+    updated = set_category_threshold(str(data['category']), threshold)
+    db.session.commit()
+    return jsonify({"category": data['category'], "threshold": threshold, "inventory_rows": updated})
+
+@api_bp.route('/stock/low', methods=['GET'])
+@auth.login_required
+def get_low_stock():
+    """Everything currently at or below its reorder point, optionally for one store, keyset-paginated"""
+    per_page = max(min(request.args.get('per_page', 500, type=int), 5000), 1)
+    query = StoreInventory.query.filter(
+        StoreInventory.reorder_point.isnot(None),
+        StoreInventory.quantity <= StoreInventory.reorder_point
+    )
+    store_id = request.args.get('store_id', type=int)
+    if store_id is not None:
+        query = query.filter(StoreInventory.store_id == store_id)
+    
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            cursor_store, cursor_product = (int(value) for value in decode_cursor(cursor))
+        except (ValueError, TypeError):
+            return jsonify({"error": "Invalid cursor"}), 400
+        query = query.filter(db.tuple_(StoreInventory.store_id, StoreInventory.product_id)
+                             > db.tuple_(cursor_store, cursor_product))
+    
+    items = query.order_by(StoreInventory.store_id, StoreInventory.product_id).limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    
+    return jsonify({
+        "next_cursor": encode_cursor(items[-1].store_id, items[-1].product_id) if has_more else None,
+        "items": [{
+            "store_id": item.store_id,
+            "product_id": item.product_id,
+            "quantity": item.quantity,
+            "reorder_point": item.reorder_point
+        } for item in items]
+    })
+
+@api_bp.route('/alerts', methods=['GET'])
+@auth.login_required
+def get_alerts():
+    """Threshold crossings, newest first, keyset-paginated like /audit/logs"""
+    per_page = max(min(request.args.get('per_page', 100, type=int), 500), 1)
+    query = StockAlert.query
+    store_id = request.args.get('store_id', type=int)
+    if store_id is not None:
+        query = query.filter(StockAlert.store_id == store_id)
+    kind = request.args.get('kind')
+    if kind:
+        query = query.filter(StockAlert.kind == kind)
+    
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            cursor_ts, cursor_id = decode_cursor(cursor)
+            cursor_ts = datetime.fromisoformat(cursor_ts)
+        except (ValueError, TypeError):
+            return jsonify({"error": "Invalid cursor"}), 400
+        query = query.filter(db.tuple_(StockAlert.created_at, StockAlert.id) < db.tuple_(cursor_ts, cursor_id))
+    
+    alerts = query.order_by(StockAlert.created_at.desc(), StockAlert.id.desc()).limit(per_page + 1).all()
+    has_more = len(alerts) > per_page
+    alerts = alerts[:per_page]
+    
+    return jsonify({
+        "next_cursor": encode_cursor(alerts[-1].created_at, alerts[-1].id) if has_more else None,
+        "alerts": [{
+            "id": alert.id,
+            "store_id": alert.store_id,
+            "product_id": alert.product_id,
+            "kind": alert.kind,
+            "threshold": alert.threshold,
+            "previous_quantity": alert.previous_quantity,
+            "quantity": alert.quantity,
+            "created_at": alert.created_at.isoformat()
+        } for alert in alerts]
+    })
+
+@api_bp.route('/products/search', methods=['GET'])
+@auth.login_required
+def get_product_search():
+    """Catalog search: name prefix, then words in name/description, then typo-tolerant name matches"""
+    term = ' '.join(request.args.get('q', '').lower().split())
+    category = request.args.get('category') or None
+    if not term and not category:
+        return jsonify({"error": "q or category is required"}), 400
+    if len(term) > 100:
+        return jsonify({"error": "q must be at most 100 characters"}), 400
+    per_page = max(min(request.args.get('per_page', 20, type=int), 100), 1)
+    
+    after = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after = [int(value) for value in decode_cursor(cursor)]
+            if len(after) != 2:
+                raise ValueError
+        except (ValueError, TypeError):
+            return jsonify({"error": "Invalid cursor"}), 400
+    
+    # Catalog rows are never written through the API, so results are cached for everyone with a TTL
+    key = search_cache_key(term, category, after, per_page)
+    response = cache.get(key)
+    if response is not None:
+        count_cache('product_search', 'hit')
+        return jsonify(response)
+    count_cache('product_search', 'miss')
+    
+    # No read-your-writes concern either, so skip read_session's marker lookup
+    session = replica_session() if current_replica() is not None else db.session
+    try:
+        products = search_products(session, term, category, after, per_page + 1)
+    except Exception as e:
+        if session is db.session:
+            raise
+        current_app.logger.warning(f"Replica read failed, using master: {e}")
+        session.rollback()
+        report_replica_failure(e)
+        count_route('master_fallback')
+        products = search_products(db.session, term, category, after, per_page + 1)
+    has_more = len(products) > per_page
+    products = products[:per_page]
+    
+    response = {
+        "next_cursor": encode_cursor(products[-1]['rank'], products[-1]['id']) if has_more else None,
+        "products": [{
+            "id": product['id'],
+            "name": product['name'],
+            "description": product['description'],
+            "category": product['category'],
+            "match": TIERS[product['rank'] // 1000]
+        } for product in products]
+    }
+    cache.set(key, response, timeout=PRODUCT_SEARCH_CACHE_TTL)
+    return jsonify(response)
+
+@api_bp.route('/import/inventory', methods=['POST'])
+@auth.login_required
+def post_inventory_import():
+    """Bulk counts (mode=absolute) or deltas (mode=delta) from a CSV/NDJSON body or a multipart 'file'"""
+    if not g.current_user.is_admin:
+        return jsonify({"error": "Admin only"}), 403
+    mode = request.args.get('mode', 'absolute')
+    if mode not in MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(MODES)}"}), 400
+    
+    upload = request.files.get('file')
+    # Multipart uploads are spooled to disk by werkzeug; raw bodies are read straight off the socket
+    stream = upload.stream if upload else request.stream
+    name = upload.filename if upload else ''
+    content_type = upload.mimetype if upload else request.mimetype
+    fmt = request.args.get('format') or (
+        'ndjson' if 'ndjson' in content_type or name.endswith(('.ndjson', '.jsonl')) else 'csv'
+    )
+    if fmt not in FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(FORMATS)}"}), 400
+    
+    try:
+        report = import_inventory(stream, fmt, mode, user_id=auth.current_user(),
+                                  abort_on_error=request.args.get('on_error') == 'abort')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if report.applied:
+        status = 200
+    else:
+        status = 422 if report.rejected else 400
+    return jsonify(report.as_dict()), status
     
 @api_bp.route('/health', methods=['GET'])
 def health_check():
     try:
-        db.session.execute("SELECT 1")
-        
-        replica_engine = db.get_engine(current_app, bind='replica')
-        replica_engine.execute("SELECT 1")
-        
-        return jsonify({
-            "status": "ok",
-            "database": {
-                "master": "healthy",
-                "replica": "healthy"
-            }
-        })
+        db.session.execute(text("SELECT 1"))
+        master = "healthy"
     except Exception as e:
-        current_app.logger.critical(f"DB health check failed: {e}")
-        return jsonify({
-            "status": "degraded",
-            "database": {
-                "master": "unhealthy" if "master" in str(e) else "healthy",
-                "replica": "unhealthy" if "replica" in str(e) else "healthy"
-            }
-        }), 500
\ No newline at end of file
+        current_app.logger.critical(f"Master health check failed: {e}")
+        master = "unhealthy"
+    
+    pool = replica_pool()
+    pool.ensure_prober()
+    replicas = pool.status()
+    healthy_replicas = sum(1 for replica in replicas if replica["healthy"])
+    
+    if master == "unhealthy":
+        status = "down"
+    elif healthy_replicas < len(replicas):
+        status = "degraded"  # reads still served, possibly from the master
+    else:
+        status = "ok"
+    
+    return jsonify({
+        "status": status,
+        "database": {
+            "master": master,
+            "replicas": replicas,
+            "healthy_replicas": healthy_replicas
+        },
+        "read_routing": dict(routing_stats),
+        "local_cache": local_stock_cache.stats()
+    }), 500 if master == "unhealthy" else 200
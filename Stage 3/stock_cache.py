@@ -0,0 +1,90 @@
+import os
+import math
+import time
+from app_factory import cache
+from metrics import count_cache
+from local_cache import local_stock_cache, publish_invalidation
+from replica_pool import REPLICA_MAX_LAG, REPLICA_PROBE_INTERVAL
+
+# Entries are evicted by the stock-update tasks after commit, so the TTL is only a backstop
+STOCK_CACHE_TTL = int(os.environ.get('STOCK_CACHE_TTL', 3600))
+STOCK_CACHE_LOCK_TIMEOUT = int(os.environ.get('STOCK_CACHE_LOCK_TIMEOUT', 5))
+STOCK_CACHE_WAIT = float(os.environ.get('STOCK_CACHE_WAIT', 0.5))
+# A list loaded this soon after an invalidation may predate the write: replicas serve reads at up to
+# REPLICA_MAX_LAG, and lag is only re-measured every probe interval, plus a second of margin
+STOCK_CACHE_SETTLE = max(
+    int(os.environ.get('STOCK_CACHE_SETTLE', 0)),
+    math.ceil(REPLICA_MAX_LAG + REPLICA_PROBE_INTERVAL) + 1
+)
+
+
+def stock_cache_key(store_id):
+    return f"stock:store:{store_id}"
+
+
+def invalidated_key(store_id):
+    return f"stock:store:{store_id}:invalidated"
+
+
+def settle_timeout(invalidated_at):
+    """Short lifetime for a list loaded right after an invalidation, None for the normal TTL"""
+    if invalidated_at is not None and time.time() - invalidated_at < STOCK_CACHE_SETTLE:
+        return STOCK_CACHE_SETTLE
+    return None
+
+
+def get_store_stock(store_id, loader):
+    """Cached stock list for a store: process memory, then Redis; on a miss only one caller runs loader"""
+    key = stock_cache_key(store_id)
+    local_stock_cache.ensure_listener()
+    data = local_stock_cache.get(key)
+    if data is not None:
+        return data
+
+    # Read before Redis, so an invalidation landing during the round trip stops the local copy
+    generation = local_stock_cache.generation
+    data, invalidated_at = cache.get_many(key, invalidated_key(store_id))
+    if data is not None:
+        count_cache('stock', 'hit')
+        local_stock_cache.set(key, data, generation, timeout=settle_timeout(invalidated_at))
+        return data
+
+    count_cache('stock', 'miss')
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, timeout=STOCK_CACHE_LOCK_TIMEOUT):
+        try:
+            invalidated_at = cache.get(invalidated_key(store_id))
+            data = loader()
+            # Skip the write if an invalidation raced the load, keep it short if one just happened
+            if cache.get(invalidated_key(store_id)) == invalidated_at:
+                timeout = settle_timeout(invalidated_at)
+                cache.set(key, data, timeout=timeout or STOCK_CACHE_TTL)
+                local_stock_cache.set(key, data, generation, timeout=timeout)
+            return data
+        finally:
+            cache.delete(lock_key)
+
+    # Someone else is loading: poll briefly, then give up and load ourselves
+    deadline = time.time() + STOCK_CACHE_WAIT
+    while time.time() < deadline:
+        time.sleep(0.02)
+        data = cache.get(key)
+        if data is not None:
+            count_cache('stock', 'waited')
+            return data
+    count_cache('stock', 'wait_timeout')
+    return loader()
+
+
+def invalidate_store_stock(store_ids):
+    """Drop cached stock lists for stores whose inventory just committed"""
+    store_ids = set(store_ids)
+    if not store_ids:
+        return
+    keys = [stock_cache_key(store_id) for store_id in store_ids]
+    cache.delete_many(*keys)
+    now = time.time()
+    cache.set_many({invalidated_key(store_id): now for store_id in store_ids}, timeout=STOCK_CACHE_TTL)
+    # After the Redis delete, so a process refilling its local tier can't pick the old list back up
+    local_stock_cache.invalidate(keys)
+    publish_invalidation(keys)